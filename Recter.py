@@ -1,31 +1,168 @@
-import copy
+import argparse
+import array
+import bisect
+import collections
+from concurrent import futures
 from enum import Enum
-import inspect
+import fnmatch
+import functools
+import json
 import logging
+import logging.handlers
+import math
+import multiprocessing
+import os
+import queue
 import re
+import shutil
+import site
 import sys
-import neovim
+import tempfile
+import threading
+import time
+try:
+    import neovim
+except ImportError:
+    # the Buffer model runs without neovim, e.g. in `main` and bench_recter.py
+    neovim = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 __logger__ = logging.getLogger('draw_rect.vim')
 
 
 class NvimOutLogHandler(logging.Handler):
     """
     python logging handler to output messages to the neovim user.
+
+    it is fed by a `QueueListener` thread. messages are collected and
+    written from the event loop, all of those of one tick in one
+    `out_write`. a message repeated within repeat_interval seconds is
+    dropped and counted instead, and the count is written once the
+    interval is over.
     """
 
     _nvim = None
     _terminator = '\n'
 
-    def __init__(self, nvim, *args, **kwargs):
+    def __init__(self, nvim, *args, repeat_interval=1.0, **kwargs):
         """Initialize."""
         super().__init__(*args, **kwargs)
         self._nvim = nvim
+        self.repeat_interval = repeat_interval
+        self.pending_lock = threading.Lock()
+        self.pending = []
+        # message -> [time last written, times dropped since]
+        self.recent = {}
 
     def emit(self, record):
         """emit."""
-        self._nvim.out_write(self.format(record))
-        self._nvim.out_write(self._terminator)
-        self.flush()
+        message = self.format(record)
+        now = time.monotonic()
+        with self.pending_lock:
+            recent = self.recent.get(message)
+            if recent is not None and now - recent[0] < self.repeat_interval:
+                recent[1] += 1
+                if recent[1] == 1:
+                    # report the count even if the message stops here
+                    timer = threading.Timer(
+                        self.repeat_interval - (now - recent[0]) + 0.01,
+                        self.report_repeats)
+                    timer.daemon = True
+                    timer.start()
+                return
+            self.recent[message] = [now, 0]
+            if recent is not None and recent[1]:
+                message += ' (repeated {} times)'.format(recent[1])
+            scheduled = bool(self.pending)
+            self.pending.append(message)
+        if not scheduled:
+            self._nvim.async_call(self.write_pending)
+
+    def report_repeats(self):
+        with self.pending_lock:
+            scheduled = bool(self.pending)
+            self.add_repeats(time.monotonic())
+            if scheduled or not self.pending:
+                return
+        self._nvim.async_call(self.write_pending)
+
+    def add_repeats(self, now):
+        # the counts of the messages whose interval is over, under the lock
+        for message, recent in self.recent.items():
+            if recent[1] and now - recent[0] >= self.repeat_interval:
+                self.pending.append(
+                    '{} (repeated {} times)'.format(message, recent[1]))
+                recent[:] = [now, 0]
+
+    def write_pending(self):
+        with self.pending_lock:
+            self.add_repeats(time.monotonic())
+            pending, self.pending = self.pending, []
+            if len(self.recent) > 1000:
+                self.recent.clear()
+        if pending:
+            self._nvim.out_write(self._terminator.join(pending)
+                                 + self._terminator)
+
+    @classmethod
+    def start(cls, nvim, level):
+        """
+        send the records of __logger__ at level and above to nvim through
+        a queue drained by a background thread.
+        """
+        records = queue.Queue()
+        __logger__.setLevel(level)
+        __logger__.addHandler(logging.handlers.QueueHandler(records))
+        listener = logging.handlers.QueueListener(records, cls(nvim))
+        listener.start()
+        return listener
+
+
+class RpcBatch(object):
+    """
+    api calls queued and sent together as one `nvim_call_atomic`.
+    """
+
+    def __init__(self, nvim):
+        self.nvim = nvim
+        self.calls = []
+
+    def call(self, name, *args):
+        """queue an api call and return the index of its result."""
+        self.calls.append([name, list(args)])
+        return len(self.calls) - 1
+
+    def command(self, command):
+        return self.call('nvim_command', command)
+
+    def function(self, name, *args):
+        return self.call('nvim_call_function', name, list(args))
+
+    def flush(self):
+        calls, self.calls = self.calls, []
+        results, error = self.nvim.api.call_atomic(calls)
+        if error is not None:
+            index, error_type, message = error
+            raise neovim.api.NvimError('{} failed: {}'.format(
+                calls[index][0], message))
+        return results
+
+
+if neovim is None:
+    class neovim(object):
+        """stand-in that leaves the plugin handlers undecorated."""
+
+        @staticmethod
+        def plugin(cls):
+            return cls
+
+        @staticmethod
+        def command(*args, **kwargs):
+            return lambda handler: handler
+
+        function = autocmd = rpc_export = command
 
 
 @neovim.plugin
@@ -37,25 +174,247 @@ class TestPlugin2(object):
     def __init__(self, nvim):
         """Recter."""
         self.nvim = nvim
-        # update the __logger__ to use neovim for messages
-        nvimhandler = NvimOutLogHandler(nvim)
-        # nvimhandler.setLevel(logging.INFO)
-        nvimhandler.setLevel(logging.DEBUG)
-        __logger__.setLevel(logging.DEBUG)
-        __logger__.addHandler(nvimhandler)
+        # update the __logger__ to use neovim for messages, e.g.
+        # `let g:recter_log_level = 'DEBUG'`
+        level = nvim.vars.get('recter_log_level', 'WARNING')
+        if isinstance(level, str):
+            level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            # an unknown name must not keep the plugin from loading
+            level = logging.WARNING
+        self.log_listener = NvimOutLogHandler.start(nvim, level)
+        # 'numpy' scans the buffer with vectorized array operations
+        Buffer.grid_backend = nvim.vars.get('recter_grid_backend', 'list')
+        Buffer.band_workers = nvim.vars.get('recter_band_workers', 0)
+        # live Buffer mirrors of attached vim buffers, keyed by number
+        self.cache = BufferCache(
+            nvim.vars.get('recter_cache_max_bytes', 64 * 1024 * 1024))
+        # rows around the window parsed first, unset parses whole buffers
+        self.viewport_margin = nvim.vars.get('recter_viewport_margin')
+        # normal buffers are parsed ahead of commands on a worker thread,
+        # up to this many lines, 0 for any size. viewport parsing turns it off
+        self.preparse = nvim.vars.get('recter_preparse', 1)
+        self.preparse_max_lines = nvim.vars.get('recter_preparse_max_lines',
+                                                0)
+        self.preparse_worker = futures.ThreadPoolExecutor(max_workers=1)
+        self.preparsing = {}
+        # writes queued until the next round trip, and round trips so far
+        self.writes = RpcBatch(nvim)
+        self.rpc_count = 0
+        self.curpos = None
+        # the focused rect border is drawn with extmarks in this namespace
+        self.namespace = self.request('nvim_create_namespace', 'recter')
+        # move and yank drags are previewed as virtual text in this one
+        self.preview_namespace = self.request('nvim_create_namespace',
+                                              'recter_preview')
+        self.highlight_group = nvim.vars.get('recter_focus_hl', 'Visual')
+        self.select_highlight_group = nvim.vars.get('recter_select_hl',
+                                                    'Search')
+        # latency of every phase, for `:RecterStats`
+        self.stats = None
+        if nvim.vars.get('recter_stats', 0):
+            self.stats = LatencyStats()
+            # not the handlers, the host registers them from the class
+            self.stats.instrument(self, [
+                'copy_vim_buffer', 'redraw', 'process_keys'])
+            self.stats.instrument(Buffer, [
+                'parse_rows', 'find_rects', 'find_no_right_end_rects',
+                'set_rect', 'delete_rect', 'reshape_rect'])
+        # active mode, its state and the keys mapped for it
+        self.mode = None
+        self.mode_state = {}
+        self.mapped_keys = []
+        self.saved_keymaps = []
+        self.mode_buffer = None
+        # the Buffer and rect `relabel` left in insert mode
+        self.relabeling = None
+        # keys received but not handled yet
+        self.pending_keys = []
+        self.keys_scheduled = False
 
     @neovim.command("Recter", range='', nargs='*', sync=True)
     def recter(self, args, range):
         """Recter command handler."""
-        self.nvim.command(
+        rpc_count = self.rpc_count
+        if self.mode is not None and \
+                self.mode_buffer != self.request('nvim_get_current_buf'):
+            # the mode was started in another buffer, write it there and
+            # leave it before starting over here
+            self.mode_state['curpos'] = None
+            self.leave_mode()
+            self.flush()
+        self.restore_mode_options()
+        self.enter_mode('init')
+        self.writes.command(
             "echo('Recter `init mode`: s:srround, i:relabel, "
-            "f:focus, m:move rect, y:yank rect, d:delete rect, u:undo')")
-        # __logger__.info('start ' + inspect.currentframe().f_code.co_name)
-        char = self.nvim.call("nr2char", self.nvim.call("getchar"))
-        self.change_mode(char)
+            "f:focus, m:move rect, y:yank rect, d:delete rect, v:select, u:undo')")
+        self.trim_cache()
+        self.flush()
+        __logger__.debug('Recter: %d rpc', self.rpc_count - rpc_count)
         return
 
+    @neovim.function('RecterKey', sync=False)
+    def on_key(self, args):
+        """
+        key of a mode keymap.
+
+        keys arrive as notifications, so the editor never waits for the
+        plugin while a mode is active. keys that queue up while the plugin
+        is busy are handled together by `process_keys`.
+        """
+        self.pending_keys.append(args[0])
+        if not self.keys_scheduled:
+            self.keys_scheduled = True
+            self.nvim.async_call(self.process_keys)
+
+    def process_keys(self):
+        rpc_count = self.rpc_count
+        keys, self.pending_keys = self.pending_keys, []
+        self.keys_scheduled = False
+        buf = self.mode_state.get('buf')
+        if buf is not None and \
+                buf.changedtick != self.mode_state.get('changedtick'):
+            # the buffer was edited outside of Recter
+            self.leave_mode(commit=False)
+            self.writes.command(
+                "echo('Recter navi: buffer changed, left Recter')")
+            keys = []
+
+        for char, count in self.coalesce_keys(keys):
+            if self.mode == 'focus':
+                self.focus_key(char, count)
+            elif self.mode == 'yank':
+                self.yank_key(char, count)
+            elif self.mode == 'move':
+                self.move_key(char, count)
+            elif self.mode == 'select':
+                self.select_key(char, count)
+            elif self.mode == 'init':
+                self.change_mode(char)
+        buf = self.mode_state.get('buf')
+        if buf is not None:
+            self.mode_state['changedtick'] = buf.changedtick
+        self.trim_cache()
+        self.flush()
+        __logger__.debug('RecterKey %s: %d rpc', ''.join(keys),
+                         self.rpc_count - rpc_count)
+
+    def coalesce_keys(self, keys):
+        """
+        split keys into (key, count) pairs.
+
+        digits are read as a count prefix like `10l`, and repeats of the
+        same direction key are merged into one pair.
+        """
+        commands = []
+        for char in keys:
+            count = self.mode_state.get('count', '')
+            if self.mode != 'init' and char.isdigit() and \
+                    (char != '0' or count):
+                self.mode_state['count'] = count + char
+                continue
+            self.mode_state['count'] = ''
+            count = int(count or 1)
+            if commands and commands[-1][0] == char \
+                    and char in KEY_DIRECTIONS:
+                commands[-1][1] += count
+            else:
+                commands.append([char, count])
+        return commands
+
+    def enter_mode(self, mode, **state):
+        """
+        switch the buffer-local keymaps to the keys of mode.
+
+        user keymaps shadowed by the mode keys are saved when the first
+        mode is entered and put back by `leave_mode`.
+        """
+        if self.mode is None:
+            # every keymap call goes to this buffer until the mode is left,
+            # even when another buffer is current by then
+            batch = RpcBatch(self.nvim)
+            batch.call('nvim_get_current_buf')
+            batch.call('nvim_buf_get_keymap', 0, 'n')
+            self.mode_buffer, keymaps = self.flush(batch)
+            self.saved_keymaps = [
+                keymap for keymap in keymaps
+                if keymap['lhs'] in MODE_KEYMAPS and 'rhs' in keymap]
+        keys = dict(MODE_KEYMAPS)
+        if mode == 'init':
+            for key in list(KEY_DIRECTIONS) + list(COUNT_KEYS):
+                del keys[key]
+        if mode != 'select':
+            for key in SELECT_KEYS:
+                del keys[key]
+        for lhs in set(self.mapped_keys) - set(keys):
+            self.writes.call('nvim_buf_del_keymap', self.mode_buffer, 'n', lhs)
+        for lhs, name in keys.items():
+            if lhs not in self.mapped_keys:
+                self.writes.call(
+                    'nvim_buf_set_keymap', self.mode_buffer, 'n', lhs,
+                    "<Cmd>call RecterKey('{}')<CR>".format(name),
+                    {'noremap': True, 'nowait': True, 'silent': True})
+        self.mapped_keys = list(keys)
+        self.mode = mode
+        self.mode_state = state
+
+    def restore_mode_options(self, commit=True):
+        # the mode may have been entered in another buffer than the current
+        buf = self.mode_state.get('buf')
+        if 'stamps' in self.mode_state:
+            self.writes.call('nvim_buf_clear_namespace', buf.vim_buffer,
+                             self.preview_namespace, 0, -1)
+            stamps = self.mode_state.pop('stamps')
+            if commit:
+                self.commit_stamps(stamps)
+        if self.mode_state.pop('highlighted', False):
+            self.clear_highlight(buf)
+
+    def commit_stamps(self, stamps):
+        """
+        write the rects previewed by move or yank mode to the buffer.
+
+        all of them go out in one redraw, so the drag is one undo entry.
+        """
+        state = self.mode_state
+        buf = state['buf']
+        sources = state.get('sources')
+        if sources is not None:
+            if state['offset'] == (0, 0):
+                return
+            # every source is cleared before any rect is drawn, the moved
+            # rects can overlap where the others were
+            for rect in sources:
+                buf.delete_rect(rect)
+        elif not stamps:
+            return
+        for rect in stamps:
+            buf.set_rect(rect)
+        self.redraw(buf, state['curpos'])
+
+    def leave_mode(self, commit=True):
+        """remove the mode keymaps and restore what the modes changed."""
+        self.restore_mode_options(commit)
+        for lhs in self.mapped_keys:
+            self.writes.call('nvim_buf_del_keymap', self.mode_buffer, 'n',
+                             lhs)
+        for keymap in self.saved_keymaps:
+            self.writes.call(
+                'nvim_buf_set_keymap', self.mode_buffer, 'n', keymap['lhs'],
+                keymap['rhs'],
+                {'noremap': bool(keymap['noremap']),
+                 'nowait': bool(keymap['nowait']),
+                 'silent': bool(keymap['silent']),
+                 'expr': bool(keymap['expr'])})
+        self.mapped_keys = []
+        self.saved_keymaps = []
+        self.mode = None
+        self.mode_buffer = None
+        self.mode_state = {}
+
     def change_mode(self, mode):
+        # switching from a mode first restores what it changed
+        self.restore_mode_options()
         if mode == 's':
             self.srround()
         elif mode == 'i':
@@ -71,35 +430,46 @@ class TestPlugin2(object):
         elif mode == 'v':
             self.select()
         elif mode == 'u':
-            self.nvim.command("u")
+            self.undo()
+        elif mode == 'redo':
+            self.undo(redo=True)
         else:
-            return
+            self.leave_mode()
+            self.writes.command("echo('')")
 
     # @neovim.autocmd('BufReadPost', pattern='*.py', sync=True)
     # def on_bufenter(self, buffname=None):
-    #     __logger__.info('start ' + inspect.currentframe().f_code.co_name)
+    #     __logger__.info('start on_bufenter')
     #     self.nvim.current.line = "autocmd_handler_insertLeave"
 
     # @neovim.autocmd('InsertLeave', pattern='*.py', sync=True)
     # def autocmd_handler_insertLeave(self):
-    #     __logger__.info('start ' + inspect.currentframe().f_code.co_name)
+    #     __logger__.info('start autocmd_handler_insertLeave')
     #     None
 
     @neovim.command("RecterCorrectFormat", range='', nargs='*', sync=True)
     def autocmd_handler_insertLeave(self, args, range):
-        self.nvim.command("augroup RecterCorrectFormatLoad")
-        self.nvim.command("autocmd!")
-        self.nvim.command("augroup END")
-        __logger__.info('start ' + inspect.currentframe().f_code.co_name)
-        vim_buffer = self.copy_vim_buffer()
-        curpos = self.nvim.call("getcurpos")
-        buf = Buffer.init(vim_buffer)
-
-        # check that current cursor position is in rect
-        rects = buf.find_no_right_end_rects()
+        rpc_count = self.rpc_count
+        self.writes.command("augroup RecterCorrectFormatLoad")
+        self.writes.command("autocmd!")
+        self.writes.command("augroup END")
+        __logger__.info('start autocmd_handler_insertLeave')
+        buf = self.load_state()
+        curpos = self.curpos
+
+        # only the rect of `relabel` was typed into, the buffer is scanned
+        # when there is none or it does not look like it was left
+        relabeling, self.relabeling = self.relabeling, None
+        if relabeling is not None and relabeling[0] is buf \
+                and buf.has_left_side(relabeling[1]):
+            rects = [relabeling[1]]
+        else:
+            rects = buf.find_no_right_end_rects()
         if not rects:
-            __logger__.info('[I] :does not exist no right end rect'
-                            + inspect.currentframe().f_code.co_name)
+            __logger__.info('[I] :does not exist no right end rect '
+                            'autocmd_handler_insertLeave')
+            self.trim_cache()
+            self.flush()
             return
 
         # reshape rects
@@ -107,25 +477,140 @@ class TestPlugin2(object):
             buf.reshape_rect(rect)
 
         self.redraw(buf, curpos)
-        self.nvim.command("Recter")
+        self.recter(args, range)
+        __logger__.debug('RecterCorrectFormat: %d rpc',
+                         self.rpc_count - rpc_count)
+
+    def undo(self, redo=False):
+        """
+        revert the last Recter edit from the journal of the buffer.
+
+        without Recter history, vim's own undo is used.
+        """
+        buf = self.load_state()
+        journal = buf.journal
+        journal.sync(buf.changedtick)
+        if not (journal.redo_entries if redo else journal.undo_entries):
+            self.leave_mode()
+            self.writes.command("redo" if redo else "undo")
+            return
+        journal.replaying = 'redo' if redo else 'undo'
+        buf.revert(journal.pop(redo))
+        self.redraw(buf, self.curpos)
+        self.enter_mode('init')
 
     def get_cursor_point(self):
-        curpos = self.nvim.call("getcurpos")
         return Buffer.translate_vim_buffer_to_buffer(Point(
-            curpos[1], curpos[2]))
+            self.curpos[1], self.curpos[2]))
+
+    def target_rects(self, buf):
+        """the selected rects, or the rect on the cursor."""
+        selection = self.mode_state.get('selection')
+        if selection:
+            return list(selection)
+        rect = buf.get_rect_on_cursor(self.get_cursor_point())
+        return [] if rect is None else [rect]
 
     def select(self):
+        """
+        start a selection with the rect on the cursor.
+
+        m, y and d then move, yank or delete all the selected rects at
+        once, and the buffer is written in one redraw.
+        """
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        buf = Buffer.init(vim_buffer)
+        buf = self.load_state()
+        curpos = self.curpos
 
         # get cursor position
         curpos_point = self.get_cursor_point()
 
         # check that current cursor position is in rect
         rect = buf.get_rect_on_cursor(curpos_point)
-        
-        self.focus()
+        if rect is None:
+            rect = buf.find_rect_nearest_neighbor(curpos_point)
+            if rect is None:
+                self.enter_mode('init')
+                self.writes.command(
+                    "echo('Recter navi: does not exist to select rect')")
+                return
+            vim_point = Buffer.translate_buffer_to_vim_buffer(rect.edges['UL'])
+            curpos = Buffer.translate_point_to_curpos(curpos, vim_point)
+            self.set_cursor(curpos)
+
+        self.enter_mode('select', buf=buf, changedtick=buf.changedtick,
+                        curpos=curpos, curpos_point=rect.edges['UL'],
+                        cursor=rect, selection=[rect])
+        self.show_selection()
+
+        self.writes.command(
+            "echo('Recter `select mode`: v:toggle, c:contained rects, "
+            "r:region, m:move, y:yank, d:delete, hjkl:cursor rect')")
+
+    def select_key(self, char, count=1):
+        state = self.mode_state
+        buf = state['buf']
+        cursor = state['cursor']
+        selection = state['selection']
+        if char in KEY_DIRECTIONS:
+            rect = None
+            for i in range(count):
+                next_rect = buf.find_rect_in_direction(
+                    state['curpos_point'], KEY_DIRECTIONS[char])
+                if next_rect is None:
+                    break
+                rect = next_rect
+                state['curpos_point'] = rect.edges['UL']
+            if rect is None:
+                return
+            state['cursor'] = rect
+            vim_point = Buffer.translate_buffer_to_vim_buffer(rect.edges['UL'])
+            self.set_cursor(Buffer.translate_point_to_curpos(
+                state['curpos'], vim_point))
+        elif char == 'v':
+            # toggle the cursor rect
+            selected = [rect for rect in selection
+                        if rect.values() != cursor.values()]
+            if len(selected) == len(selection):
+                selected.append(cursor)
+            state['selection'] = selected
+        elif char == 'c':
+            # the rects inside the cursor rect
+            self.add_to_selection(buf.iter_rects(cursor.top, cursor.bottom),
+                                  cursor.top, cursor.left,
+                                  cursor.bottom, cursor.right)
+        elif char == 'r':
+            # the rects inside the region from the first selected rect to
+            # the cursor rect
+            rects = selection[:1] + [cursor]
+            top = min(rect.top for rect in rects)
+            bottom = max(rect.bottom for rect in rects)
+            self.add_to_selection(buf.iter_rects(top, bottom + 1), top,
+                                  min(rect.left for rect in rects), bottom,
+                                  max(rect.right for rect in rects))
+        else:
+            self.change_mode(char)
+            return
+        self.show_selection()
+
+    def add_to_selection(self, rects, top, left, bottom, right):
+        """add the rects inside the box top, left, bottom, right."""
+        selection = self.mode_state['selection']
+        selected = set(rect.values() for rect in selection)
+        for rect in rects:
+            if rect.top >= top and rect.bottom <= bottom \
+                    and min(rect.left, rect.lower_left) >= left \
+                    and rect.right <= right \
+                    and rect.values() not in selected:
+                selected.add(rect.values())
+                selection.append(rect)
+
+    def show_selection(self):
+        state = self.mode_state
+        self.highlight_rects(state['buf'], state['selection'],
+                             self.select_highlight_group)
+        self.draw_border(state['buf'], state['cursor'],
+                         self.highlight_group, priority=4097)
 
     def relabel(self):
         """
@@ -133,9 +618,9 @@ class TestPlugin2(object):
         ||
         +-------+
         """
+        self.leave_mode()
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        buf = Buffer.init(vim_buffer)
+        buf = self.load_state()
 
         # get cursor position
         curpos_point = self.get_cursor_point()
@@ -151,57 +636,265 @@ class TestPlugin2(object):
             vim_point = Buffer.translate_buffer_to_vim_buffer(
                 rect.get_label_start_point())
             label_start_pos = Buffer.translate_point_to_curpos(
-                self.nvim.call("getcurpos"), vim_point)
+                self.curpos, vim_point)
             # into instert mode
+            self.relabeling = (buf, rect)
             self.redraw(buf, label_start_pos)
-            self.nvim.command("startinsert")
-            self.nvim.command("augroup RecterCorrectFormatLoad")
-            self.nvim.command("autocmd!")
-            self.nvim.command("autocmd InsertLeave * RecterCorrectFormat")
-            self.nvim.command("augroup END")
+            self.writes.command("startinsert")
+            self.writes.command("augroup RecterCorrectFormatLoad")
+            self.writes.command("autocmd!")
+            self.writes.command("autocmd InsertLeave * RecterCorrectFormat")
+            self.writes.command("augroup END")
+
+    def request(self, name, *args):
+        self.rpc_count += 1
+        return self.nvim.request(name, *args)
+
+    def flush(self, batch=None):
+        """send the queued writes, or batch, as one round trip."""
+        if batch is None:
+            batch = self.writes
+        if not batch.calls:
+            return []
+        self.rpc_count += 1
+        return batch.flush()
+
+    def load_state(self):
+        """
+        read the cursor and window state in one round trip and return the
+        Buffer mirror of the current vim buffer.
+        """
+        self.flush()
+        batch = RpcBatch(self.nvim)
+        batch.call('nvim_get_current_buf')
+        batch.call('nvim_buf_get_changedtick', 0)
+        batch.function('getcurpos')
+        if self.viewport_margin is not None:
+            batch.function('line', 'w0')
+            batch.function('line', 'w$')
+        results = self.flush(batch)
+        vim_buffer, changedtick, self.curpos = results[:3]
+        buf = self.get_buffer(vim_buffer, changedtick)
+        if self.viewport_margin is not None:
+            top, bottom = results[3:]
+            buf.viewport = (top - 1 - self.viewport_margin,
+                            bottom + self.viewport_margin)
+        return buf
+
+    def copy_vim_buffer(self, vim_buffer, attach):
+        """
+        return the lines of vim_buffer, the `b:changedtick` they are at and
+        whether it was attached.
+
+        the tick is read in the same atomic call as the lines, the
+        `nvim_buf_lines_event` of an edit made after a tick read earlier
+        would be applied to lines that already have it.
+        """
+        batch = RpcBatch(self.nvim)
+        batch.call('nvim_buf_get_lines', vim_buffer, 0, -1, True)
+        batch.call('nvim_buf_get_changedtick', vim_buffer)
+        if attach:
+            batch.call('nvim_buf_attach', vim_buffer, False, {})
+        results = self.flush(batch)
+        attached = attach and results[2]
+        return ([Buffer.make_row(line) for line in results[0]], results[1],
+                attached)
+
+    def get_buffer(self, vim_buffer, changedtick):
+        """
+        return the Buffer mirror of vim_buffer.
+
+        the mirror is kept up to date by `nvim_buf_lines_event`, so the
+        whole buffer is only fetched when it is not cached for the current
+        `b:changedtick`.
+        """
+        buf = self.cache.get(vim_buffer.number, changedtick)
+        if buf is not None:
+            return buf
+
+        attach = vim_buffer.number not in self.cache
+        buf_table, changedtick, attached = self.copy_vim_buffer(vim_buffer,
+                                                                attach)
+        buf = Buffer.init(buf_table)
+        buf.vim_buffer = vim_buffer
+        buf.changedtick = changedtick
+        if attach and not attached:
+            return buf
+        for number in self.cache.put(vim_buffer.number, buf):
+            self.writes.call('nvim_buf_detach', number)
+        return buf
+
+    def trim_cache(self):
+        """evict mirrors grown past the cache size, but not the mode's."""
+        buf = self.mode_state.get('buf')
+        keep = () if buf is None else (buf.vim_buffer.number,)
+        for number in self.cache.trim(keep):
+            self.writes.call('nvim_buf_detach', number)
+
+    @neovim.command("RecterCacheStats", nargs='*', sync=True)
+    def cache_stats(self, args):
+        self.echo(', '.join('{}: {}'.format(key, value)
+                            for key, value in self.cache.stats().items()))
+        self.flush()
+
+    @neovim.command("RecterStats", nargs='?', complete='file', sync=True)
+    def latency_stats(self, args):
+        """show the latency of every phase, or write it to the file args."""
+        if self.stats is None:
+            self.echo('Recter stats are off, let g:recter_stats = 1')
+        elif args:
+            self.stats.dump(args[0])
+            self.echo('Recter stats written to {}'.format(args[0]))
+        else:
+            lines = ['{:<40} {:>7} {:>10} {:>8} {:>8} {:>8} {:>8}'.format(
+                'phase (ms)', 'count', 'total', 'p50', 'p95', 'p99', 'max')]
+            for name, phase in self.stats.report().items():
+                lines.append(
+                    '{:<40} {count:>7} {total:>10.2f} {p50:>8.2f} '
+                    '{p95:>8.2f} {p99:>8.2f} {max:>8.2f}'.format(
+                        name, **phase))
+            self.writes.call('nvim_out_write', '\n'.join(lines) + '\n')
+        self.flush()
+
+    @neovim.autocmd('BufEnter,CursorHold', pattern='*', sync=False)
+    def on_idle(self):
+        """
+        parse the current buffer on the worker thread.
+
+        only normal buffers, `&buftype` empty, are parsed, so the first
+        command in a buffer already finds its rects. edits are picked up by
+        the next CursorHold, not on every TextChanged, so typing and Recter
+        writes do not each start a parse. the worker parses a snapshot of
+        the lines. its rects are only taken when the buffer is still at the
+        `b:changedtick` of the snapshot.
+        """
+        if not self.preparse or self.viewport_margin is not None:
+            return
+        batch = RpcBatch(self.nvim)
+        batch.call('nvim_get_current_buf')
+        batch.call('nvim_buf_get_option', 0, 'buftype')
+        batch.call('nvim_buf_get_changedtick', 0)
+        batch.call('nvim_buf_line_count', 0)
+        vim_buffer, buftype, changedtick, line_count = self.flush(batch)
+        if buftype != '' \
+                or 0 < self.preparse_max_lines < line_count \
+                or self.preparsing.get(vim_buffer.number) == changedtick:
+            return
+        buf = self.get_buffer(vim_buffer, changedtick)
+        self.flush()
+        if not buf.buf_table or buf.parsed_rows == [(0, len(buf.buf_table))]:
+            return
+        # the lines may have been fetched at a later tick
+        changedtick = buf.changedtick
+        self.preparsing[vim_buffer.number] = changedtick
+        snapshot = [line[:] for line in buf.buf_table]
+        future = self.preparse_worker.submit(self.parse_snapshot, snapshot)
+        future.add_done_callback(
+            lambda future: self.nvim.async_call(
+                self.on_preparsed, vim_buffer.number, changedtick, future))
+
+    @classmethod
+    def parse_snapshot(cls, snapshot):
+        parsed = Buffer(snapshot)
+        parsed.parse_rows()
+        return parsed
+
+    def on_preparsed(self, number, changedtick, future):
+        if self.preparsing.get(number) == changedtick:
+            del self.preparsing[number]
+        buf = self.cache.peek(number)
+        if future.exception() is not None:
+            __logger__.debug('preparse failed: %s', future.exception())
+            return
+        if buf is None or buf.changedtick != changedtick or buf.dirty_rows:
+            # stale, the buffer changed while it was parsed
+            return
+        buf.adopt_parse(future.result())
+        self.trim_cache()
+        self.flush()
+
+    @neovim.rpc_export('nvim_buf_lines_event', sync=False)
+    def on_buf_lines(self, vim_buffer, changedtick, firstline, lastline,
+                     linedata, more):
+        buf = self.cache.peek(vim_buffer.number)
+        # changes up to buf.changedtick are already in the mirror
+        if buf is None or buf.changedtick is None \
+                or changedtick <= buf.changedtick:
+            return
+        buf.apply_lines(firstline, lastline, linedata)
+        buf.changedtick = changedtick
+
+    @neovim.rpc_export('nvim_buf_changedtick_event', sync=False)
+    def on_buf_changedtick(self, vim_buffer, changedtick):
+        buf = self.cache.peek(vim_buffer.number)
+        if buf is not None and buf.changedtick is not None:
+            buf.changedtick = max(buf.changedtick, changedtick)
 
-    def copy_vim_buffer(self):
-        vim_buffer = self.nvim.current.buffer
-        return [list(line) for line in vim_buffer]
+    @neovim.rpc_export('nvim_buf_detach_event', sync=False)
+    def on_buf_detach(self, vim_buffer):
+        self.cache.pop(vim_buffer.number)
 
     def redraw(self, buf, curpos):
-        self.nvim.command("%delete")
-        vim_buffer = []
-        for line in buf.buf_table:
-            vim_buffer.append("".join(line))
-        self.nvim.call("append", 1, vim_buffer)
-        self.nvim.command("1delete")
-        # self.nvim.current.buffer = vim_buffer
-        self.nvim.call('setpos', '.', curpos)
-        self.nvim.command("redraw")
+        # push only the rows touched since the last sync together with the
+        # queued writes, in one atomic call. the rows go to the vim buffer
+        # of buf, which need not be the current one. curpos None leaves
+        # the cursor alone.
+        vim_buffer = buf.vim_buffer
+        for start, end in buf.pop_dirty_ranges():
+            lines = [line.tounicode() for line in buf.buf_table[start:end]]
+            self.writes.call('nvim_buf_set_lines', vim_buffer, start,
+                             min(end, buf.synced_len), False, lines)
+        if len(buf.buf_table) < buf.synced_len:
+            self.writes.call('nvim_buf_set_lines', vim_buffer,
+                             len(buf.buf_table), buf.synced_len, False, [])
+        buf.synced_len = len(buf.buf_table)
+        if curpos is not None:
+            self.writes.function('setpos', '.', curpos)
+            self.curpos = curpos
+        self.writes.command('redraw')
+        index = self.writes.call('nvim_buf_get_changedtick', vim_buffer)
+        buf.journal.sync(buf.changedtick)
+        # if the write fails the next command fetches the buffer again
+        buf.changedtick = None
+        buf.changedtick = self.flush()[index]
+        buf.journal.commit(buf.buf_table, buf.changedtick)
 
     def delete(self):
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        curpos = self.nvim.call("getcurpos")
-        buf = Buffer.init(vim_buffer)
-
-        # get cursor position
-        curpos_point = self.get_cursor_point()
+        buf = self.load_state()
+        curpos = self.curpos
 
-        rect = buf.get_rect_on_cursor(curpos_point)
-        if rect is None:
-            self.nvim.command(
+        rects = self.target_rects(buf)
+        if not rects:
+            self.enter_mode('init')
+            self.writes.command(
                 "echo('Recter navi: Retry delete operation on `target rect`')")
             return
 
-        buf.delete_rect(rect)
+        for rect in rects:
+            buf.delete_rect(rect)
         self.redraw(buf, curpos)
+        # the deleted rects must not stay selected if nothing is left to
+        # focus
+        self.enter_mode('init')
         self.change_mode('f')
 
     def echo(self, value):
-        self.nvim.command("echo(\"{}\")".format(value))
+        self.writes.command("echo(\"{}\")".format(value))
+
+    def set_cursor(self, curpos, buf=None):
+        # moving the cursor alone leaves the buffer and its undo untouched
+        line = curpos[1]
+        if buf is not None:
+            # a previewed rect can reach past the last line
+            line = min(line, buf.synced_len)
+        self.writes.call('nvim_win_set_cursor', 0, [line, curpos[2] - 1])
+        self.curpos = curpos
 
     def focus(self):
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        curpos = self.nvim.call("getcurpos")
-        buf = Buffer.init(vim_buffer)
+        buf = self.load_state()
+        curpos = self.curpos
 
         # get cursor position
         curpos_point = self.get_cursor_point()
@@ -210,169 +903,201 @@ class TestPlugin2(object):
         if rect is None:
             rect = buf.find_rect_nearest_neighbor(curpos_point)
             if rect is None:
-                self.nvim.command(
+                # nothing to focus, drop what the last mode was doing
+                self.enter_mode('init')
+                self.writes.command(
                     "echo('Recter navi: does not exist to focus rect')")
                 return
             vim_point = Buffer.translate_buffer_to_vim_buffer(rect.edges['UL'])
             curpos = Buffer.translate_point_to_curpos(curpos, vim_point)
-            self.redraw(buf, curpos)
-
-        cursorline_org_status = self.nvim.current.window.options['cursorline']
-        cursorcolumn_org_status = \
-            self.nvim.current.window.options['cursorcolumn']
-        self.nvim.command("set cursorline")
-        self.nvim.command("set cursorcolumn")
+            self.set_cursor(curpos)
 
-        self.nvim.command
-        ("echo('Recter `focus mode`: s:srround, i:relabel, "
-         "f:focus, m:move rect, y:yank rect, d:delete rect, u:undo')")
+        self.enter_mode('focus', buf=buf, changedtick=buf.changedtick,
+                        curpos=curpos, curpos_point=curpos_point)
+        self.highlight_rect(buf, rect)
 
-        # focus
-        while True:
-            char = self.nvim.call("nr2char", self.nvim.call("getchar"))
-            target_rects = []
-            if char == 'h':
-                target_rects = [
-                    rect for rect in buf.find_rects() if rect.edges['UL'].x < curpos_point.x]
-            elif char == 'j':
-                target_rects = [
-                    rect for rect in buf.find_rects() if rect.edges['UL'].y > curpos_point.y]
-            elif char == 'k':
-                target_rects = [
-                    rect for rect in buf.find_rects() if rect.edges['UL'].y < curpos_point.y]
-            elif char == 'l':
-                target_rects = [
-                    rect for rect in buf.find_rects() if rect.edges['UL'].x > curpos_point.x]
-            else:
-                self.change_mode(char)
-                self.nvim.current.window.options['cursorline'] = \
-                    cursorline_org_status
-                self.nvim.current.window.options['cursorcolumn'] = \
-                    cursorcolumn_org_status
-                return
+        self.writes.command(
+            "echo('Recter `focus mode`: s:srround, i:relabel, "
+            "f:focus, m:move rect, y:yank rect, d:delete rect, v:select, u:undo')")
 
-            if not target_rects:
-                continue
-            sorted_rects = sorted(
-                target_rects, key=lambda rect: Points.calc_point_distance(
-                    curpos_point, rect.edges['UL']))
-            curpos_point = sorted_rects[0].edges['UL']
-            # update cursor point
-            vim_point = Buffer.translate_buffer_to_vim_buffer(curpos_point)
-            curpos = Buffer.translate_point_to_curpos(curpos, vim_point)
-            self.redraw(buf, curpos)
-            # self.highlight_rect(sorted_rects[0])
+    def focus_key(self, char, count=1):
+        state = self.mode_state
+        if char not in KEY_DIRECTIONS:
+            self.change_mode(char)
+            return
 
-    def highlight_rect(self, rect):
-        vlen = rect.edges['LL'].y - rect.edges['UL'].y
-        hlen = rect.edges['UR'].x - rect.edges['UL'].x
-        self.nvim.command("exe \"normal!\<C-v>{}j{}l\"".format(vlen, hlen))
+        buf = state['buf']
+        rect = None
+        for i in range(count):
+            next_rect = buf.find_rect_in_direction(
+                state['curpos_point'], KEY_DIRECTIONS[char])
+            if next_rect is None:
+                break
+            rect = next_rect
+            state['curpos_point'] = rect.edges['UL']
+        if rect is None:
+            return
+        # update cursor point
+        vim_point = Buffer.translate_buffer_to_vim_buffer(rect.edges['UL'])
+        curpos = Buffer.translate_point_to_curpos(state['curpos'], vim_point)
+        self.set_cursor(curpos)
+        self.highlight_rect(buf, rect)
+
+    def highlight_rect(self, buf, rect):
+        self.highlight_rects(buf, [rect])
+
+    def highlight_rects(self, buf, rects, group=None):
+        """draw the borders of rects with extmarks, replacing the last ones."""
+        self.clear_highlight(buf)
+        for rect in rects:
+            self.draw_border(buf, rect, group or self.highlight_group)
+        self.mode_state['highlighted'] = True
+
+    def draw_border(self, buf, rect, group, priority=4096):
+        upper_left = rect.edges['UL']
+        lower_left = rect.edges['LL']
+        right_x = rect.edges['UR'].x
+        for y, start_x, end_x in \
+                [(upper_left.y, upper_left.x, right_x + 1),
+                 (lower_left.y, lower_left.x, rect.edges['LR'].x + 1)] + \
+                [(y, x, x + 1)
+                 for y in range(upper_left.y + 1, lower_left.y)
+                 for x in (upper_left.x, right_x)]:
+            start_col = buf.byte_col(y, start_x)
+            self.writes.call(
+                'nvim_buf_set_extmark', buf.vim_buffer, self.namespace, y,
+                start_col,
+                {'end_row': y, 'hl_group': group, 'priority': priority,
+                 'end_col': start_col + buf.byte_len(y, start_x, end_x)})
+
+    def clear_highlight(self, buf):
+        self.writes.call('nvim_buf_clear_namespace', buf.vim_buffer,
+                         self.namespace, 0, -1)
 
     def yank(self):
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        curpos = self.nvim.call("getcurpos")
-        buf = Buffer.init(vim_buffer)
-
-        # get cursor position
-        curpos_point = self.get_cursor_point()
+        buf = self.load_state()
 
-        rect = buf.get_rect_on_cursor(curpos_point)
-        if rect is None:
-            self.nvim.command(
+        rects = self.target_rects(buf)
+        if not rects:
+            self.enter_mode('init')
+            self.writes.command(
                 "echo('Recter navi: Retry yank operation on `target rect`')")
             return
 
-        cursorline_org_status = self.nvim.current.window.options['cursorline']
-        cursorcolumn_org_status = self.nvim.current.window.options['cursorcolumn']
-        self.nvim.command("set cursorline")
-        self.nvim.command("set cursorcolumn")
+        self.enter_mode('yank', buf=buf, changedtick=buf.changedtick,
+                        rects=rects, curpos=self.curpos, stamps=[])
+        self.highlight_rects(buf, rects)
 
-        self.nvim.command("echo('Recter `yank mode`: s:srround, i:relabel, "
-        "f:focus, m:move rect, y:yank rect, d:delete rect, u:undo')")
+        self.writes.command("echo('Recter `yank mode`: s:srround, i:relabel, "
+        "f:focus, m:move rect, y:yank rect, d:delete rect, v:select, u:undo')")
 
+    def yank_key(self, char, count=1):
         # past
         h_space_dist = 1
         v_space_dist = 1
-        while True:
-            char = self.nvim.call("nr2char", self.nvim.call("getchar"))
-            if char == 'h':
-                distance = rect.get_len_horizon_line() + h_space_dist
-                rect.jump_move(Direction.L, distance)
-            elif char == 'j':
-                distance = rect.get_len_vertical_line() + v_space_dist
-                rect.jump_move(Direction.D, distance)
-            elif char == 'k':
-                distance = rect.get_len_vertical_line() + v_space_dist
-                rect.jump_move(Direction.U, distance)
-            elif char == 'l':
-                distance = rect.get_len_horizon_line() + h_space_dist
-                rect.jump_move(Direction.R, distance)
-            else:
-                self.change_mode(char)
-                self.nvim.current.window.options['cursorline'] = cursorline_org_status
-                self.nvim.current.window.options['cursorcolumn'] = cursorcolumn_org_status
-                return
+        buf = self.mode_state['buf']
+        rects = self.mode_state['rects']
+        if char not in KEY_DIRECTIONS:
+            self.change_mode(char)
+            return
 
-            vim_point = Buffer.translate_buffer_to_vim_buffer(
-                rect.get_label_start_point())
-            curpos = Buffer.translate_point_to_curpos(
-                self.nvim.call("getcurpos"), vim_point)
-            buf.set_rect(rect)
-            self.redraw(buf, curpos)
+        # a copy is left at every step. the copies are previewed and only
+        # written to the buffer when the mode is left. selected rects are
+        # copied together, stepping by the size of the whole selection.
+        width = max(rect.right for rect in rects) \
+            - min(rect.left for rect in rects) + 1
+        height = max(rect.bottom for rect in rects) \
+            - min(rect.top for rect in rects) + 1
+        if char in 'hl':
+            distance = width + h_space_dist
+        else:
+            distance = height + v_space_dist
+        stamps = []
+        for i in range(count):
+            dy, dx = Rect.jump_offset(rects, KEY_DIRECTIONS[char], distance)
+            rects = [rect.translate(dy, dx) for rect in rects]
+            stamps.extend(rects)
+        self.mode_state['rects'] = rects
+        self.mode_state['stamps'].extend(stamps)
+        self.preview_rects(buf, stamps)
+
+        vim_point = Buffer.translate_buffer_to_vim_buffer(
+            rects[0].get_label_start_point())
+        curpos = Buffer.translate_point_to_curpos(self.curpos, vim_point)
+        self.mode_state['curpos'] = curpos
+        self.set_cursor(curpos, buf)
 
     def move(self):
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        curpos = self.nvim.call("getcurpos")
-        buf = Buffer.init(vim_buffer)
+        buf = self.load_state()
+        curpos = self.curpos
 
-        # get cursor position
-        curpos_point = self.get_cursor_point()
+        rects = self.target_rects(buf)
+        if not rects:
+            self.enter_mode('init')
+            self.writes.command("echo('Recter navi: Retry move operation on `target rect`')")
+            return
 
-        rect = buf.get_rect_on_cursor(curpos_point)
-        if rect is None:
-            self.nvim.command("echo('Recter navi: Retry move operation on `target rect`')")
+        self.writes.command("echo('Recter `move mode`: s:srround, i:relabel, "
+        "f:focus, m:move rect, y:yank rect, d:delete rect, v:select, u:undo')")
+
+        # the sources stay highlighted in place until the move is written
+        self.enter_mode('move', buf=buf, changedtick=buf.changedtick,
+                        rects=rects, sources=rects, offset=(0, 0),
+                        curpos=curpos, stamps=rects)
+        self.highlight_rects(buf, rects)
+
+    def move_key(self, char, count=1):
+        state = self.mode_state
+        buf = state['buf']
+        rects = state['rects']
+        curpos = state['curpos']
+        if char not in KEY_DIRECTIONS:
+            self.change_mode(char)
             return
 
-        self.nvim.command("echo('Recter `move mode`: s:srround, i:relabel, "
-        "f:focus, m:move rect, y:yank rect, d:delete rect, u:undo')")
+        # the rects move by one offset, so the selection keeps its shape
+        dy, dx = Rect.jump_offset(rects, KEY_DIRECTIONS[char], count)
+        moved = [rect.translate(dy, dx) for rect in rects]
+        curpos[1] += dy
+        curpos[2] += dx
+        state['rects'] = state['stamps'] = moved
+        state['offset'] = (state['offset'][0] + dy, state['offset'][1] + dx)
 
-        # move loop
-        buf.delete_rect(rect)
-        buf_back = copy.deepcopy(buf)
-        while True:
-            char = self.nvim.call("nr2char", self.nvim.call("getchar"))
-            if char == 'h':
-                rect.move(Direction.L)
-                curpos[2] -= 1
-            elif char == 'j':
-                rect.move(Direction.D)
-                curpos[1] += 1
-            elif char == 'k':
-                rect.move(Direction.U)
-                curpos[1] -= 1
-            elif char == 'l':
-                rect.move(Direction.R)
-                curpos[2] += 1
-            else:
-                self.change_mode(char)
-                return
+        self.writes.call('nvim_buf_clear_namespace', buf.vim_buffer,
+                         self.preview_namespace, 0, -1)
+        self.preview_rects(buf, moved)
+        self.set_cursor(curpos, buf)
 
-            buf = copy.deepcopy(buf_back)
-            buf.set_rect(rect)
-            self.redraw(buf, curpos)
+    def preview_rects(self, buf, rects):
+        """
+        overlay rects on the window as virtual text.
+
+        only the rows that exist in the vim buffer can be previewed. a run
+        is anchored at the byte of its first cell, so it follows horizontal
+        scrolling, and past the end of a line it is padded with spaces.
+        """
+        for rect in rects:
+            for y, x, text in Buffer.render_rect(rect):
+                if y >= buf.synced_len:
+                    continue
+                text = ' ' * (x - len(buf.buf_table[y])) + text
+                self.writes.call(
+                    'nvim_buf_set_extmark', buf.vim_buffer,
+                    self.preview_namespace, y, buf.byte_col(y, x),
+                    {'virt_text': [[text, self.highlight_group]],
+                     'virt_text_pos': 'overlay'})
 
     def srround(self):
         # get current vim-buffer
-        vim_buffer = self.copy_vim_buffer()
-        buf = Buffer.init(vim_buffer)
+        buf = self.load_state()
 
         # get cursor position
-        curpos = self.nvim.call("getcurpos")
+        curpos = self.curpos
         curpos_point = Buffer.translate_vim_buffer_to_buffer(
             Point(curpos[1], curpos[4]))
-        current_line = self.nvim.current.line
+        current_line = buf.buf_table[curpos_point.y].tounicode()
 
         # get cursor_word
         cursor_word = " "
@@ -381,7 +1106,8 @@ class TestPlugin2(object):
         if current_line[curpos_point.x] == " ":
             return
         if current_line[curpos_point.x] != " ":
-            cursor_word = self.nvim.call("expand", "<cWORD>")
+            cursor_word = self.request('nvim_call_function', 'expand',
+                                       ['<cWORD>'])
 
         # detect rects current buffer
         # get start point of cursor position word
@@ -397,7 +1123,10 @@ class TestPlugin2(object):
 
         buf.create_rect(cursor_word_start_point, cursor_word_end_point)
         self.redraw(buf, curpos)
-        self.nvim.command("Recter")
+        self.enter_mode('init')
+        self.writes.command(
+            "echo('Recter `init mode`: s:srround, i:relabel, "
+            "f:focus, m:move rect, y:yank rect, d:delete rect, v:select, u:undo')")
 
 class Direction(Enum):
     L = 1
@@ -405,6 +1134,23 @@ class Direction(Enum):
     U = 3
     R = 4
 
+
+KEY_DIRECTIONS = {'h': Direction.L, 'j': Direction.D,
+                  'k': Direction.U, 'l': Direction.R}
+
+COUNT_KEYS = '0123456789'
+
+# array type of Buffer rows, 'u' is deprecated from python 3.13
+ROW_TYPECODE = 'w' if 'w' in array.typecodes else 'u'
+
+# keymaps installed while a Recter mode is active, lhs -> key name
+# keys of select mode only
+SELECT_KEYS = 'cr'
+
+MODE_KEYMAPS = dict([(key, key)
+                     for key in 'sifymdvuhjkl' + SELECT_KEYS + COUNT_KEYS]
+                    + [('<Esc>', 'esc'), ('<C-r>', 'redo')])
+
 class Points(object):
     def __init__(self, points):
         self.points = points
@@ -431,10 +1177,8 @@ class Points(object):
     def calc_point_distance(cls, point1, point2):
         return ((point1.y - point2.y) ** 2) + ((point1.x - point2.x) ** 2)
 
-class Point(object):
-    def __init__(self, y, x):
-        self.y = y
-        self.x = x
+class Point(collections.namedtuple('Point', 'y x')):
+    __slots__ = ()
 
     def _format(self):
         return 'y:{}, x:{}'.format(self.y, self.x)
@@ -443,11 +1187,6 @@ class Point(object):
         return '<{} at {} {}>'.format(
             type(self).__name__, hex(id(self)), self._format())
 
-    def __eq__(self, other):
-        if self.y == other.y and self.x == other.x:
-            return True
-        return False
-
     def __add__(self, other):
         return Point(self.y + other.y, self.x + other.x)
 
@@ -463,83 +1202,912 @@ class Point(object):
 
 
 class Rect(object):
+    """
+    rect value.
+
+    a rect is its upper y, left x, right x, lower y and lower left x (the
+    lower left edge may sit left of the upper one), and whether it has a
+    label line. moving a rect returns a new one.
+    """
     edge_shape = "+"
     horizon_line_shape = "-"
     vertical_line_shape = "|"
 
+    __slots__ = ('top', 'left', 'right', 'bottom', 'lower_left', 'labeled',
+                 'label')
+
     def __init__(self, upper_left, upper_right, lower_right, lower_left,
                  rect_in_lines=[]):
-        self.edges = {'UL': upper_left, 'UR': upper_right,
-                     'LR': lower_right, 'LL': lower_left}
+        self.top = upper_left.y
+        self.left = upper_left.x
+        self.right = upper_right.x
+        self.bottom = lower_left.y
+        self.lower_left = lower_left.x
+        # label is empty
+        self.labeled = len(rect_in_lines) != 0
+        self.label = rect_in_lines[0] if self.labeled else []
 
-        if len(rect_in_lines) == 0:
-            # label is empty
-            self.label = []
-            self.label_points = {'START': upper_left+Point(1, 1), 'END': upper_right+Point(1, 1)}
-        else:
-            self.label_points = {'START': upper_left+Point(1, 1), 'END': upper_right+Point(1, -1)}
-            self.label = rect_in_lines[0]
+    @classmethod
+    def from_values(cls, values, label):
+        rect = cls.__new__(cls)
+        (rect.top, rect.left, rect.right, rect.bottom, rect.lower_left,
+         labeled) = values
+        rect.labeled = bool(labeled)
+        rect.label = label
+        return rect
+
+    def values(self):
+        return (self.top, self.left, self.right, self.bottom,
+                self.lower_left, int(self.labeled))
+
+    @property
+    def edges(self):
+        return {'UL': Point(self.top, self.left),
+                'UR': Point(self.top, self.right),
+                'LR': Point(self.bottom, self.right),
+                'LL': Point(self.bottom, self.lower_left)}
+
+    @property
+    def label_points(self):
+        end_dx = -1 if self.labeled else 1
+        return {'START': Point(self.top + 1, self.left + 1),
+                'END': Point(self.top + 1, self.right + end_dx)}
 
     def delete_label(self):
         self.label = []
-        self.label_points = {'START': self.edges['UL'] + Point(1, 1), 'END': self.edges['UR'] + Point(1, 1)}
+        self.labeled = False
 
     def get_label_start_point(self):
-        return self.label_points['START']
+        return Point(self.top + 1, self.left + 1)
+
+    def translate(self, dy, dx):
+        return Rect.from_values(
+            (self.top + dy, self.left + dx, self.right + dx,
+             self.bottom + dy, self.lower_left + dx, self.labeled),
+            self.label)
 
     def jump_move(self, direction, distance):
-        [self.move(direction) for i in range(distance)]
+        # one translation, stopping at the top and left end like `move`
+        return self.translate(*Rect.jump_offset([self], direction, distance))
 
-    def move(self, direction):
+    @classmethod
+    def jump_offset(cls, rects, direction, distance):
+        """
+        the (dy, dx) that moves rects together by distance, stopping where
+        the first of them reaches the top or left end.
+        """
         if direction == Direction.L:
-            if self.edges['UL'].x == 0:
-                return
-            for point in self.edges.values():
-                point.x -= 1
-            for lp in self.label_points.values():
-                lp.x -= 1
+            left = min(min(rect.left, rect.lower_left) for rect in rects)
+            return 0, -min(distance, left)
         if direction == Direction.D:
-            for point in self.edges.values():
-                point.y += 1
-            for lp in self.label_points.values():
-                lp.y += 1
+            return distance, 0
         if direction == Direction.U:
-            if self.edges['UL'].y == 0:
-                return
-            for point in self.edges.values():
-                point.y -= 1
-            for lp in self.label_points.values():
-                lp.y -= 1
-        if direction == Direction.R:
-            for point in self.edges.values():
-                point.x += 1
-            for lp in self.label_points.values():
-                lp.x += 1
+            return -min(distance, min(rect.top for rect in rects)), 0
+        return 0, distance
+
+    def move(self, direction):
+        return self.jump_move(direction, 1)
 
     def get_len_horizon_line(self):
-        return self.edges['UR'].x - self.edges['UL'].x + 1
+        return self.right - self.left + 1
 
     def get_len_vertical_line(self):
-        return self.edges['LL'].y - self.edges['UL'].y + 1
+        return self.bottom - self.top + 1
 
     @classmethod
     def init(cls, upper_left, lower_right):
         upper_right = Point(upper_left.y, lower_right.x)
         lower_left = Point(lower_right.y, upper_left.x)
-        cls.edges = {'UL': upper_left, 'UR': upper_right,
-                     'LR': lower_right, 'LL': lower_left}
-        return cls
+        return cls(upper_left, upper_right, lower_right, lower_left)
+
+
+class RectScanner(object):
+    """
+    single pass rect detector.
+
+    every cell is classified once. each `+` is linked to the next `+` on
+    its right and left (across `-` only) and below (across `|` only), so
+    a rect is read off the links of its upper left edge without walking
+    its borders again.
+    """
+
+    @classmethod
+    def link_edges(cls, lines, start_y=0, col_open=None):
+        """
+        link the edges of lines, the first of which is row start_y.
+
+        col_open maps a column to the (y, has_vline) of the last edge whose
+        `|` run is still open at the row above start_y. the state after
+        the last line is returned so that scans can be chained.
+        """
+        right = {}
+        left = {}
+        down = {}
+        edges = []
+        if col_open is None:
+            col_open = {}
+        for y, line in enumerate(lines, start_y):
+            row_open = {}
+            open_x = None
+            exit_hline = False
+            for x, s in enumerate(line):
+                if s == Rect.edge_shape:
+                    edges.append((y, x))
+                    if open_x is not None and exit_hline:
+                        right[(y, open_x)] = x
+                        left[(y, x)] = open_x
+                    open_x = x
+                    exit_hline = False
+                    state = col_open.get(x)
+                    if state is not None and state[1]:
+                        down[(state[0], x)] = y
+                    row_open[x] = (y, False)
+                elif s == Rect.horizon_line_shape:
+                    exit_hline = True
+                else:
+                    open_x = None
+                    if s == Rect.vertical_line_shape:
+                        state = col_open.get(x)
+                        if state is not None:
+                            row_open[x] = (state[0], True)
+            col_open = row_open
+        return edges, (right, left, down), col_open
+
+    @classmethod
+    def link_bands(cls, lines, start_y, executor, band_count, col_open=None):
+        """
+        `link_edges` of lines split into horizontal bands scanned by
+        executor.
+
+        each band is scanned as if no `|` run entered it from above. the
+        merge follows the runs still open at the bottom of a band down
+        through the next ones, so the links are the same as a serial scan.
+        """
+        band_size = max(-(-len(lines) // band_count), 1)
+        starts = list(range(0, len(lines), band_size))
+        results = executor.map(
+            cls.link_edges,
+            [[line.tounicode() for line in lines[start:start + band_size]]
+             for start in starts],
+            [start_y + start for start in starts])
+        edges = []
+        right = {}
+        left = {}
+        down = {}
+        if col_open is None:
+            col_open = {}
+        passing = {}
+        for start, (band_edges, links, band_open) in zip(starts, results):
+            for x, (open_y, has_vline) in col_open.items():
+                y = start
+                while y < len(lines) and x < len(lines[y]) and \
+                        lines[y][x] == Rect.vertical_line_shape:
+                    has_vline = True
+                    y += 1
+                if y == len(lines):
+                    passing[x] = (open_y, has_vline)
+                elif has_vline and x < len(lines[y]) and \
+                        lines[y][x] == Rect.edge_shape:
+                    down[(open_y, x)] = start_y + y
+            edges.extend(band_edges)
+            right.update(links[0])
+            left.update(links[1])
+            down.update(links[2])
+            col_open = band_open
+        col_open.update(passing)
+        return edges, (right, left, down), col_open
+
+    @classmethod
+    def build_rects(cls, edges, links):
+        """return the `RectTable` values of the rects the links close."""
+        right, left, down = links
+        rects = []
+        for y, x in edges:
+            right_x = right.get((y, x))
+            if right_x is None:
+                continue
+            lower_y = down.get((y, right_x))
+            if lower_y is None:
+                continue
+            lower_left_x = left.get((lower_y, right_x))
+            if lower_left_x is None:
+                continue
+            rects.append((y, x, right_x, lower_y, lower_left_x,
+                          int(lower_y > y + 1)))
+        return rects
+
+
+class RectTable(object):
+    """
+    rects stored as rows of ints in one array('i').
+
+    a row is the `Rect.values` of a rect. rows are addressed by id and the
+    ids of removed rows are reused.
+    """
+    width = 6
+
+    def __init__(self):
+        self.array = array.array('i')
+        self.free = []
+
+    def add(self, values):
+        if self.free:
+            rect_id = self.free.pop()
+            offset = rect_id * self.width
+            self.array[offset:offset + self.width] = array.array('i', values)
+            return rect_id
+        self.array.extend(values)
+        return len(self.array) // self.width - 1
+
+    def remove(self, rect_id):
+        self.free.append(rect_id)
+
+    def values(self, rect_id):
+        offset = rect_id * self.width
+        return tuple(self.array[offset:offset + self.width])
+
+    def top(self, rect_id):
+        return self.array[rect_id * self.width]
+
+    def left(self, rect_id):
+        return self.array[rect_id * self.width + 1]
+
+    def right(self, rect_id):
+        return self.array[rect_id * self.width + 2]
+
+    def bottom(self, rect_id):
+        return self.array[rect_id * self.width + 3]
+
+    def shift(self, rect_id, dy):
+        offset = rect_id * self.width
+        self.array[offset] += dy
+        self.array[offset + 3] += dy
+
+    def memory_size(self):
+        return self.array.buffer_info()[1] * self.array.itemsize
+
+
+class RectIndex(object):
+    """
+    grid bucket index of the rects of a `RectTable`.
+
+    rect ids are bucketed by their upper left edge (for neighbor queries),
+    by every bucket they cover (for point queries) and by the rows they
+    cover (for invalidation), so lookups only visit the buckets around the
+    query instead of every rect.
+    """
+    bucket_size = 16
+
+    def __init__(self, table):
+        self.table = table
+        self.edge_buckets = {}
+        self.area_buckets = {}
+        self.row_buckets = {}
+        # keys of the edge buckets: sorted bucket rows, and the sorted bucket
+        # columns of each row
+        self.edge_rows = []
+        self.edge_cols = {}
+
+    @classmethod
+    def bucket_key(cls, point):
+        return (point.y // cls.bucket_size, point.x // cls.bucket_size)
+
+    def order_key(self, rect_id):
+        # row-major order of the upper left edge, the order of `find_rects`
+        return (self.table.top(rect_id), self.table.left(rect_id))
+
+    def covered_keys(self, rect_id):
+        table = self.table
+        for by in range(table.top(rect_id) // self.bucket_size,
+                        table.bottom(rect_id) // self.bucket_size + 1):
+            for bx in range(table.left(rect_id) // self.bucket_size,
+                            table.right(rect_id) // self.bucket_size + 1):
+                yield (by, bx)
+
+    def row_keys(self, rect_id):
+        return range(self.table.top(rect_id) // self.bucket_size,
+                     self.table.bottom(rect_id) // self.bucket_size + 1)
+
+    @classmethod
+    def insert_entry(cls, bucket, entry):
+        # buckets stay sorted by order key so the first hit of a scan is the
+        # rect a linear scan of `find_rects` would return
+        keys = [key for key, rect_id in bucket]
+        bucket.insert(bisect.bisect(keys, entry[0]), entry)
+
+    def add(self, rect_id):
+        order = self.order_key(rect_id)
+        entry = (order, rect_id)
+        key = self.bucket_key(Point(*order))
+        if key not in self.edge_buckets:
+            by, bx = key
+            if by not in self.edge_cols:
+                self.edge_cols[by] = []
+                bisect.insort(self.edge_rows, by)
+            bisect.insort(self.edge_cols[by], bx)
+        self.insert_entry(self.edge_buckets.setdefault(key, []), entry)
+        for key in self.covered_keys(rect_id):
+            self.insert_entry(self.area_buckets.setdefault(key, []), entry)
+        for by in self.row_keys(rect_id):
+            self.row_buckets.setdefault(by, []).append(entry)
+
+    @classmethod
+    def remove_entry(cls, buckets, key, rect_id):
+        bucket = [entry for entry in buckets[key] if entry[1] != rect_id]
+        if bucket:
+            buckets[key] = bucket
+        else:
+            del buckets[key]
+
+    def discard(self, rect_id):
+        key = self.bucket_key(Point(*self.order_key(rect_id)))
+        self.remove_entry(self.edge_buckets, key, rect_id)
+        if key not in self.edge_buckets:
+            by, bx = key
+            cols = self.edge_cols[by]
+            del cols[bisect.bisect_left(cols, bx)]
+            if not cols:
+                del self.edge_cols[by]
+                del self.edge_rows[bisect.bisect_left(self.edge_rows, by)]
+        for key in self.covered_keys(rect_id):
+            self.remove_entry(self.area_buckets, key, rect_id)
+        for by in self.row_keys(rect_id):
+            self.remove_entry(self.row_buckets, by, rect_id)
+
+    def find_in_rows(self, start, end):
+        """return the ids of the rects covering any row in [start, end)."""
+        table = self.table
+        found = {}
+        for by in range(start // self.bucket_size,
+                        (end - 1) // self.bucket_size + 1):
+            for key, rect_id in self.row_buckets.get(by, []):
+                if table.top(rect_id) < end and \
+                        table.bottom(rect_id) >= start:
+                    found[key] = rect_id
+        return list(found.values())
+
+    def is_point_in_rect(self, point, rect_id):
+        table = self.table
+        return (table.top(rect_id) <= point.y <= table.bottom(rect_id)
+                and table.left(rect_id) <= point.x <= table.right(rect_id))
+
+    def find_containing(self, point):
+        for key, rect_id in self.area_buckets.get(self.bucket_key(point), []):
+            if self.is_point_in_rect(point, rect_id):
+                return rect_id
+        return None
+
+    def find_nearest(self, point, direction=None):
+        """
+        return the id of the rect whose upper left edge is nearest to point.
+
+        only populated buckets are visited, nearest first, until no closer
+        edge can exist. with a direction only the edges on that side of
+        point are candidates, and the buckets off that side are skipped.
+        ties are broken by rect order like a linear scan.
+        """
+        if not self.edge_buckets:
+            return None
+
+        # the bucket rows and columns that can hold an edge on that side
+        size = self.bucket_size
+        min_y = min_x = -1
+        max_y = max_x = None
+        if direction == Direction.L:
+            max_x = (point.x - 1) // size
+        elif direction == Direction.D:
+            min_y = (point.y + 1) // size
+        elif direction == Direction.U:
+            max_y = (point.y - 1) // size
+        elif direction == Direction.R:
+            min_x = (point.x + 1) // size
+
+        best = None
+        best_key = None
+        for by in self.nearest_keys(self.edge_rows, point.y, min_y, max_y):
+            dy = self.bucket_gap(by, point.y)
+            if best_key is not None and dy * dy > best_key[0]:
+                break
+            for bx in self.nearest_keys(self.edge_cols[by], point.x, min_x,
+                                        max_x):
+                dx = self.bucket_gap(bx, point.x)
+                if best_key is not None and dy * dy + dx * dx > best_key[0]:
+                    break
+                for order, rect_id in self.edge_buckets[(by, bx)]:
+                    if not self.is_on_side(order, point, direction):
+                        continue
+                    rect_key = ((point.y - order[0]) ** 2
+                                + (point.x - order[1]) ** 2, order)
+                    if best_key is None or rect_key < best_key:
+                        best_key = rect_key
+                        best = rect_id
+        return best
+
+    @classmethod
+    def bucket_gap(cls, key, value):
+        """the distance from value to the nearest cell of bucket key."""
+        start = key * cls.bucket_size
+        return max(start - value, value - (start + cls.bucket_size - 1), 0)
+
+    @classmethod
+    def nearest_keys(cls, keys, value, min_key, max_key):
+        """
+        the sorted keys in [min_key, max_key], nearest to value first.
+
+        keys are taken from both sides of value, so the buckets of a query
+        are visited in order of their distance.
+        """
+        start = bisect.bisect_left(keys, min_key)
+        end = len(keys) if max_key is None \
+            else bisect.bisect_right(keys, max_key)
+        down = bisect.bisect_left(keys, value // cls.bucket_size, start, end)
+        up = down - 1
+        while up >= start or down < end:
+            if down < end and (up < start or
+                               cls.bucket_gap(keys[down], value)
+                               <= cls.bucket_gap(keys[up], value)):
+                yield keys[down]
+                down += 1
+            else:
+                yield keys[up]
+                up -= 1
+
+    @classmethod
+    def is_on_side(cls, order, point, direction):
+        y, x = order
+        if direction == Direction.L:
+            return x < point.x
+        elif direction == Direction.D:
+            return y > point.y
+        elif direction == Direction.U:
+            return y < point.y
+        elif direction == Direction.R:
+            return x > point.x
+        return True
+
+
+class NumpyGrid(object):
+    """
+    character grid backed by a padded 2-D uint32 array of code points.
+
+    cells outside of a line are 0, and one row and column of 0 pad every
+    side, so runs of `-` or `|` never continue across line ends.
+    """
+    edge_code = ord(Rect.edge_shape)
+    horizon_line_code = ord(Rect.horizon_line_shape)
+    vertical_line_code = ord(Rect.vertical_line_shape)
+    space_code = ord(' ')
+
+    def __init__(self, buf_table):
+        self.height = 0
+        self.array = numpy.zeros((2, 2), dtype=numpy.uint32)
+        self.sync(buf_table, range(len(buf_table)))
+
+    @classmethod
+    def encode(cls, line):
+        if line.itemsize == 4:
+            # the row buffer already holds the code points
+            return numpy.frombuffer(line, dtype=numpy.uint32)
+        return numpy.frombuffer(
+            line.tounicode().encode('utf-32-le'), dtype='<u4')
+
+    def resize(self, height, width):
+        rows, cols = self.array.shape
+        if height + 2 <= rows and width + 2 <= cols:
+            return
+        array = numpy.zeros((max(height + 2, rows), max(width + 2, cols)),
+                            dtype=numpy.uint32)
+        array[:rows, :cols] = self.array
+        self.array = array
+
+    def sync(self, buf_table, rows):
+        """re-encode rows of buf_table and drop rows past its end."""
+        if len(buf_table) < self.height:
+            self.array[len(buf_table) + 1:self.height + 1] = 0
+        self.height = len(buf_table)
+        rows = [y for y in rows if y < self.height]
+        if not rows:
+            return
+        self.resize(self.height, max(len(buf_table[y]) for y in rows))
+        for y in rows:
+            codes = self.encode(buf_table[y])
+            self.array[y + 1, 1:len(codes) + 1] = codes
+            self.array[y + 1, len(codes) + 1:] = 0
+
+    def blank(self, upper_y, lower_y, left_x, right_x):
+        """blank the cells of lines in the given range, like `delete_rect`."""
+        area = self.array[upper_y + 1:lower_y + 1, left_x + 1:right_x + 1]
+        area[area != 0] = self.space_code
+
+    def edge_points(self, start=0, end=None):
+        if end is None:
+            end = self.height
+        ys, xs = numpy.nonzero(
+            self.array[start + 1:end + 1] == self.edge_code)
+        return list(zip((ys + start).tolist(), (xs - 1).tolist()))
+
+    @classmethod
+    def link_runs(cls, flat, edge_code, line_code):
+        """
+        link each edge to the next edge in flat when only line_code cells
+        (at least one) lie between them.
+        """
+        edges = numpy.flatnonzero(flat == edge_code)
+        counts = numpy.concatenate(
+            ([0], numpy.cumsum(flat == line_code)))
+        start, end = edges[:-1], edges[1:]
+        gap = end - start - 1
+        linked = (gap > 0) & (counts[end] - counts[start + 1] == gap)
+        return start[linked], end[linked]
+
+    def link_edges(self, start=0, end=None):
+        """same result as `RectScanner.link_edges` for rows [start, end)."""
+        if end is None:
+            end = self.height
+        # keep the row above and below, which break runs across columns
+        area = self.array[start:end + 2]
+        rows, cols = area.shape
+        first, second = self.link_runs(
+            area.ravel(), self.edge_code, self.horizon_line_code)
+        ys = (first // cols + start - 1).tolist()
+        left_xs = (first % cols - 1).tolist()
+        right_xs = (second % cols - 1).tolist()
+        right = dict(zip(zip(ys, left_xs), right_xs))
+        left = dict(zip(zip(ys, right_xs), left_xs))
+
+        first, second = self.link_runs(
+            area.T.ravel(), self.edge_code, self.vertical_line_code)
+        xs = (first // rows - 1).tolist()
+        down = dict(zip(zip((first % rows + start - 1).tolist(), xs),
+                        (second % rows + start - 1).tolist()))
+        return self.edge_points(start, end), (right, left, down)
+
+
+class BufferCache(object):
+    """
+    parsed Buffers keyed by vim buffer number and valid for one
+    `b:changedtick`.
+
+    the least recently used Buffers are evicted once the estimated size of
+    all of them exceeds max_bytes. the most recent one is always kept.
+    Buffers grow after they are cached, so `trim` is run again after
+    every command.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.buffers = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, number):
+        return number in self.buffers
+
+    def peek(self, number):
+        return self.buffers.get(number)
+
+    def get(self, number, changedtick):
+        buf = self.buffers.get(number)
+        if buf is None or buf.changedtick != changedtick or buf.dirty_rows:
+            # unsynced rows mean a command stopped halfway, fetch again
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.buffers.move_to_end(number)
+        return buf
+
+    def put(self, number, buf):
+        """cache buf and return the numbers of the evicted buffers."""
+        self.buffers[number] = buf
+        self.buffers.move_to_end(number)
+        return self.trim()
+
+    def trim(self, keep=()):
+        """
+        evict the least recently used Buffers, except the most recent one
+        and the numbers keep, until they fit in max_bytes. return the
+        numbers of the evicted buffers.
+        """
+        evicted = []
+        sizes = collections.OrderedDict(
+            (number, buf.memory_size())
+            for number, buf in self.buffers.items())
+        size = sum(sizes.values())
+        for number in list(sizes)[:-1]:
+            if size <= self.max_bytes:
+                break
+            if number in keep:
+                continue
+            del self.buffers[number]
+            size -= sizes[number]
+            evicted.append(number)
+            self.evictions += 1
+        return evicted
+
+    def pop(self, number):
+        return self.buffers.pop(number, None)
+
+    def size(self):
+        return sum(buf.memory_size() for buf in self.buffers.values())
+
+    def stats(self):
+        return collections.OrderedDict([
+            ('buffers', len(self.buffers)), ('bytes', self.size()),
+            ('hits', self.hits), ('misses', self.misses),
+            ('evictions', self.evictions)])
+
+
+class LatencyStats(object):
+    """
+    call counts and latency histograms of the plugin phases.
+
+    methods are only timed once `instrument` wraps them, so nothing is
+    measured, or paid for, while the stats are off. calls off the main
+    thread, i.e. preparses, are kept apart under a ' (background)' name.
+    """
+
+    # histogram buckets from 1us up, each 2 ** (1 / 4) (~19%) wider
+    base = 1e-6
+    bucket_ratio = 2 ** 0.25
+
+    def __init__(self):
+        # name -> [count, total seconds, max seconds, bucket counts]
+        self.phases = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def instrument(self, owner, names):
+        """replace the methods names of owner with timed ones."""
+        prefix = owner.__name__ + '.' if isinstance(owner, type) else ''
+        for name in names:
+            setattr(owner, name,
+                    self.timed(prefix + name, getattr(owner, name)))
+
+    def timed(self, name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if threading.current_thread() is threading.main_thread():
+                    self.record(name, elapsed)
+                else:
+                    self.record(name + ' (background)', elapsed)
+        return wrapper
+
+    def record(self, name, seconds):
+        bucket = 0
+        if seconds > self.base:
+            bucket = int(math.ceil(math.log(seconds / self.base,
+                                            self.bucket_ratio)))
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = [0, 0.0, 0.0,
+                                             collections.Counter()]
+            phase[0] += 1
+            phase[1] += seconds
+            phase[2] = max(phase[2], seconds)
+            phase[3][bucket] += 1
+
+    def percentile(self, phase, fraction):
+        """upper bound of the bucket holding the fraction of the calls."""
+        count, total, slowest, buckets = phase
+        seen = 0
+        for bucket in sorted(buckets):
+            seen += buckets[bucket]
+            if seen >= fraction * count:
+                return min(self.base * self.bucket_ratio ** bucket, slowest)
+        return slowest
+
+    def report(self):
+        """per phase count, total, p50, p95, p99 and max, in ms."""
+        with self.lock:
+            phases = [(name, phase[:3] + [collections.Counter(phase[3])])
+                      for name, phase in self.phases.items()]
+        report = collections.OrderedDict()
+        for name, phase in phases:
+            report[name] = collections.OrderedDict(
+                [('count', phase[0]), ('total', phase[1] * 1000)]
+                + [(key, self.percentile(phase, fraction) * 1000)
+                   for key, fraction in (('p50', 0.5), ('p95', 0.95),
+                                         ('p99', 0.99))]
+                + [('max', phase[2] * 1000)])
+        return report
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class UndoJournal(object):
+    """
+    undo and redo history of the Recter edits of one buffer.
+
+    the rows an edit touches are copied the first time they are touched
+    and `commit` keeps only the cells that changed, so an entry is as large
+    as the edit and not the buffer. the history is only valid while the
+    buffer is at the `b:changedtick` of the last Recter write.
+    """
+
+    # rough size of one journaled cell
+    cell_size = 8
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.undo_entries = []
+        self.redo_entries = []
+        # bytes of the entries, kept as they are added and dropped
+        self.size = 0
+        self.changedtick = None
+        # rows as they were before the current edit, and the row count
+        self.rows = None
+        self.row_count = 0
+        # 'undo' or 'redo' while an entry is being reverted
+        self.replaying = None
+
+    def sync(self, changedtick):
+        """drop the history if the buffer was edited outside of Recter."""
+        if self.changedtick != changedtick:
+            self.undo_entries = []
+            self.redo_entries = []
+            self.size = 0
+            self.changedtick = changedtick
+
+    def pop(self, redo=False):
+        """take the last undo, or redo, entry to revert."""
+        entry = (self.redo_entries if redo else self.undo_entries).pop()
+        self.size -= self.entry_size(entry)
+        return entry
+
+    def capture(self, buf_table, start, end):
+        if self.rows is None:
+            self.rows = {}
+            self.row_count = len(buf_table)
+        # rows added by this edit are empty before it
+        for y in range(start, min(end, self.row_count)):
+            if y not in self.rows:
+                self.rows[y] = buf_table[y][:]
+
+    @classmethod
+    def diff_row(cls, before, after):
+        """trim the common head and tail of before and after."""
+        start = 0
+        limit = min(len(before), len(after))
+        while start < limit and before[start] == after[start]:
+            start += 1
+        end = 0
+        while end < limit - start and before[-1 - end] == after[-1 - end]:
+            end += 1
+        return start, before[start:len(before) - end], \
+            after[start:len(after) - end]
+
+    def commit(self, buf_table, changedtick):
+        """turn the captured rows into a history entry."""
+        # without captured rows nothing was edited and no row was added
+        if self.rows is None:
+            rows, row_count = {}, len(buf_table)
+        else:
+            rows, row_count = self.rows, self.row_count
+        self.rows = None
+        self.row_count = 0
+        cells = []
+        for y in sorted(set(rows) | set(range(row_count, len(buf_table)))):
+            before = rows.get(y, Buffer.make_row())
+            after = buf_table[y] if y < len(buf_table) else Buffer.make_row()
+            if before != after:
+                cells.append((y,) + self.diff_row(before, after))
+        replaying, self.replaying = self.replaying, None
+        self.changedtick = changedtick
+        if not cells and row_count == len(buf_table):
+            return
+        entry = (row_count, len(buf_table), cells)
+        self.size += self.entry_size(entry)
+        if replaying == 'undo':
+            self.redo_entries.append(entry)
+            return
+        if replaying is None:
+            self.drop(self.redo_entries)
+            self.redo_entries = []
+        self.undo_entries.append(entry)
+        self.drop(self.undo_entries[:-self.max_entries])
+        del self.undo_entries[:-self.max_entries]
+
+    def drop(self, entries):
+        self.size -= sum(self.entry_size(entry) for entry in entries)
+
+    @classmethod
+    def entry_size(cls, entry):
+        row_count, changed_row_count, cells = entry
+        return cls.cell_size * sum(len(old) + len(new)
+                                   for y, x, old, new in cells)
+
+    def memory_size(self):
+        return self.size
 
 
 class Buffer(object):
-    def __init__(self, buf_table, rects=[], no_right_end_rects=[]):
-        self.buf_table = buf_table
+    # 'list' or 'numpy', falls back to 'list' when numpy is not installed
+    grid_backend = 'list'
+    # list backend scans of at least band_threshold rows are split across
+    # band_workers processes, 0 keeps them serial
+    band_workers = 0
+    band_threshold = 20000
+    band_executor = None
+
+    def __init__(self, buf_table, rects=[], no_right_end_rects=[],
+                 grid_backend=None):
+        self.buf_table = [line if isinstance(line, array.array)
+                          else self.make_row(line) for line in buf_table]
         self.no_right_end_rects = no_right_end_rects
+        if grid_backend is None:
+            grid_backend = Buffer.grid_backend
+        self.grid = None
+        if grid_backend == 'numpy' and numpy is not None:
+            self.grid = NumpyGrid(self.buf_table)
+        self.grid_stale_rows = set()
+        # ids in rect_table of the rects of the parsed rows keyed by their
+        # upper left edge. parsed rows are kept as sorted, disjoint
+        # [start, end) ranges.
+        self.rects = {}
+        self.parsed_rows = []
+        self.rect_table = RectTable()
+        self.rect_index = RectIndex(self.rect_table)
+        # rows changed since the last redraw and the vim buffer line count
+        self.dirty_rows = set()
+        self.synced_len = len(buf_table)
+        # the vim buffer this mirrors and its `b:changedtick`
+        self.vim_buffer = None
+        self.changedtick = None
+        self.journal = UndoJournal()
+        # rows to parse first, None parses the whole buffer
+        self.viewport = None
+        # bytes of the rows, counted on the first `memory_size`, and the
+        # bytes of the rows changed since then as they were counted
+        self.row_bytes = None
+        self.resized_rows = {}
 
     @classmethod
     def init(cls, buf_table):
         return Buffer(buf_table)
 
+    @classmethod
+    def make_row(cls, line=''):
+        """
+        a mutable row of characters from a str or an iterable of them.
+
+        rows are arrays of code points, 4 bytes a cell, that convert to and
+        from vim lines with one copy.
+        """
+        return array.array(ROW_TYPECODE, line)
+
+    # rough size of the index entries of a parsed rect
+    rect_size = 256
+
+    def memory_size(self):
+        """estimated bytes, only the rows changed since the last call are
+        measured again."""
+        if self.row_bytes is None:
+            self.row_bytes = sum(sys.getsizeof(line)
+                                 for line in self.buf_table)
+        else:
+            for y, size in self.resized_rows.items():
+                self.row_bytes += self.row_size(y) - size
+        self.resized_rows = {}
+        size = sys.getsizeof(self.buf_table) + self.row_bytes
+        size += len(self.rects) * self.rect_size
+        size += self.rect_table.memory_size()
+        if self.grid is not None:
+            size += self.grid.array.nbytes
+        return size + self.journal.memory_size()
+
+    def row_size(self, y):
+        if y < len(self.buf_table):
+            return sys.getsizeof(self.buf_table[y])
+        return 0
+
     @classmethod
     def translate_vim_buffer_to_buffer(self, point):
         return Point(point.y - 1, point.x - 1)
@@ -564,58 +2132,289 @@ class Buffer(object):
 
         left_end_x = rect.edges['UL'].x
         right_end_x = rect.edges['UR'].x + 1
+        grid = self.get_grid()
+        if grid is not None:
+            grid.blank(upper_limit_y, lower_limit_y, left_end_x, right_end_x)
+        self.touch_rows(upper_limit_y, lower_limit_y, grid is not None)
         for line in lines:
             line[left_end_x:right_end_x] = \
-                [' '] * len(line[left_end_x:right_end_x])
+                self.make_row(' ' * len(line[left_end_x:right_end_x]))
+
+    def touch_rows(self, start, end, grid_synced=False):
+        self.journal.capture(self.buf_table, start, end)
+        if self.row_bytes is not None:
+            for y in range(start, end):
+                if y not in self.resized_rows:
+                    self.resized_rows[y] = self.row_size(y)
+        self.dirty_rows.update(range(start, end))
+        self.unparse_rows(start, end)
+        if self.grid is not None and not grid_synced:
+            self.grid_stale_rows.update(range(start, end))
+
+    def unparse_rows(self, start, end):
+        """forget the rects covering rows [start, end)."""
+        for rect_id in self.rect_index.find_in_rows(start, end):
+            self.remove_parsed_rect(rect_id)
+        parsed_rows = []
+        for parsed_start, parsed_end in self.parsed_rows:
+            if parsed_start < start:
+                parsed_rows.append((parsed_start, min(parsed_end, start)))
+            if parsed_end > end:
+                parsed_rows.append((max(parsed_start, end), parsed_end))
+        self.parsed_rows = parsed_rows
+
+    def add_parsed_rect(self, values):
+        rect_id = self.rect_table.add(values)
+        self.rects[self.rect_index.order_key(rect_id)] = rect_id
+        self.rect_index.add(rect_id)
+
+    def remove_parsed_rect(self, rect_id):
+        del self.rects[self.rect_index.order_key(rect_id)]
+        self.rect_index.discard(rect_id)
+        self.rect_table.remove(rect_id)
+
+    def get_rect(self, rect_id):
+        """a Rect of a parsed rect, with its label read from the buffer."""
+        values = self.rect_table.values(rect_id)
+        top, left, right = values[:3]
+        label = self.buf_table[top + 1][left + 1:right] if values[5] \
+            else self.make_row()
+        return Rect.from_values(values, label)
+
+    def is_barrier_row(self, y):
+        # every rect crossing a row has a `+` or `|` on it
+        line = self.buf_table[y]
+        return (Rect.edge_shape not in line
+                and Rect.vertical_line_shape not in line)
+
+    def expand_to_block(self, start, end):
+        """extend [start, end) to the barrier rows around it."""
+        while start > 0 and not self.is_barrier_row(start - 1):
+            start -= 1
+        while end < len(self.buf_table) and not self.is_barrier_row(end):
+            end += 1
+        return start, end
+
+    def find_unparsed_row(self, y):
+        for parsed_start, parsed_end in self.parsed_rows:
+            if parsed_start <= y < parsed_end:
+                y = parsed_end
+        return y
+
+    def parse_rows(self, start=0, end=None):
+        """detect the rects of every unparsed block overlapping [start, end)."""
+        if end is None or end > len(self.buf_table):
+            end = len(self.buf_table)
+        if start >= end:
+            return
+        # a block can be parsed only in part after its rows were touched
+        start, end = self.expand_to_block(start, end)
+        if not self.parsed_rows and self.band_workers and \
+                end - start >= self.band_threshold:
+            # one banded scan of every block at once
+            for values in self.scan_rects(start, end):
+                self.add_parsed_rect(values)
+            self.mark_parsed(start, end)
+            return
+        y = self.find_unparsed_row(start)
+        while y < end:
+            if self.is_barrier_row(y):
+                # no rect can cross these rows
+                block_end = y + 1
+                while block_end < end and self.is_barrier_row(block_end):
+                    block_end += 1
+                self.mark_parsed(y, block_end)
+                y = self.find_unparsed_row(block_end)
+                continue
+            block_start, block_end = self.expand_to_block(y, y + 1)
+            for rect_id in self.rect_index.find_in_rows(
+                    block_start, block_end):
+                self.remove_parsed_rect(rect_id)
+            for values in self.scan_rects(block_start, block_end):
+                self.add_parsed_rect(values)
+            self.mark_parsed(block_start, block_end)
+            y = self.find_unparsed_row(block_end)
+
+    def adopt_parse(self, parsed):
+        """take the rects of parsed, a parse of the same lines."""
+        self.rects = parsed.rects
+        self.parsed_rows = parsed.parsed_rows
+        self.rect_table = parsed.rect_table
+        self.rect_index = parsed.rect_index
+
+    def mark_parsed(self, start, end):
+        parsed_rows = []
+        for parsed_start, parsed_end in sorted(
+                self.parsed_rows + [(start, end)]):
+            if parsed_rows and parsed_rows[-1][1] >= parsed_start:
+                parsed_rows[-1] = (parsed_rows[-1][0],
+                                   max(parsed_rows[-1][1], parsed_end))
+            else:
+                parsed_rows.append((parsed_start, parsed_end))
+        self.parsed_rows = parsed_rows
+
+    def apply_lines(self, first, last, lines):
+        """
+        apply a `nvim_buf_lines_event` to buf_table.
+
+        rects that overlap the replaced lines are forgotten and the rects
+        below are shifted, so only the changed block is parsed again.
+        """
+        if last < 0:
+            last = len(self.buf_table)
+        delta = len(lines) - (last - first)
+        if self.row_bytes is not None:
+            for y in range(first, last):
+                if y in self.resized_rows:
+                    self.row_bytes -= self.resized_rows.pop(y)
+                else:
+                    self.row_bytes -= self.row_size(y)
+        self.buf_table[first:last] = [self.make_row(line) for line in lines]
+        if self.row_bytes is not None:
+            self.row_bytes += sum(self.row_size(y)
+                                  for y in range(first, first + len(lines)))
+            self.resized_rows = dict(
+                (y if y < last else y + delta, size)
+                for y, size in self.resized_rows.items())
+        self.synced_len += delta
+        self.dirty_rows = set(
+            y if y < last else y + delta for y in self.dirty_rows
+            if y < first or y >= last)
+
+        self.unparse_rows(first, max(last, first + 1))
+        if delta != 0:
+            rect_ids = self.rect_index.find_in_rows(
+                last, max(last, len(self.buf_table) - delta))
+            # shifted in place in the table, keeping their ids
+            for rect_id in rect_ids:
+                del self.rects[self.rect_index.order_key(rect_id)]
+                self.rect_index.discard(rect_id)
+            for rect_id in rect_ids:
+                self.rect_table.shift(rect_id, delta)
+                self.rects[self.rect_index.order_key(rect_id)] = rect_id
+                self.rect_index.add(rect_id)
+            self.parsed_rows = [
+                (start, end) if end <= first
+                else (start + delta, end + delta)
+                for start, end in self.parsed_rows]
+        # the rows around the change may join blocks that were apart
+        self.unparse_rows(max(first - 1, 0), first + len(lines) + 1)
+
+        if self.grid is not None:
+            if delta != 0:
+                self.grid_stale_rows.update(
+                    range(first, len(self.buf_table)))
+            else:
+                self.grid_stale_rows.update(range(first, last))
+
+    def revert(self, entry):
+        """put back the cells a journal entry changed."""
+        row_count, changed_row_count, cells = entry
+        rows = [y for y, x, old, new in cells]
+        if row_count != len(self.buf_table):
+            rows += [row_count, len(self.buf_table)]
+        self.touch_rows(min(rows), max(rows) + 1)
+        while len(self.buf_table) < row_count:
+            self.buf_table.append(self.make_row())
+        for y, x, old, new in cells:
+            self.buf_table[y][x:x + len(new)] = old
+        del self.buf_table[row_count:]
+
+    def get_grid(self):
+        if self.grid is not None:
+            self.grid.sync(self.buf_table, self.grid_stale_rows)
+            self.grid_stale_rows = set()
+        return self.grid
+
+    def pop_dirty_ranges(self):
+        ranges = []
+        for y in sorted(self.dirty_rows):
+            if ranges and ranges[-1][1] == y:
+                ranges[-1][1] = y + 1
+            else:
+                ranges.append([y, y + 1])
+        self.dirty_rows = set()
+        return [tuple(r) for r in ranges]
 
     def find_rect_nearest_neighbor(self, point):
-        rects = self.find_rects()
-        if not rects:
+        rect_id = self.find_nearest_rect(point)
+        if rect_id is None:
             return None
+        return self.get_rect(rect_id)
 
-        distance = sys.maxsize
-        nearest_neighbor_rect = None
-        for rect in rects:
-            rect_point = rect.edges['UL']
-            t_distance = Points.calc_point_distance(point, rect_point)
-            if t_distance < distance:
-                distance = t_distance
-                nearest_neighbor_rect = copy.deepcopy(rect)
+    def find_rect_in_direction(self, point, direction):
+        rect_id = self.find_nearest_rect(point, direction)
+        if rect_id is None:
+            return None
+        return self.get_rect(rect_id)
+
+    def find_nearest_rect(self, point, direction=None):
+        """
+        find the id of the nearest rect parsing only the viewport rows, or
+        the rows around point, at first.
 
-        return nearest_neighbor_rect
+        the rows are widened until no rect outside of them can be nearer
+        than the one found, so the result is the same as a full parse.
+        """
+        if self.viewport is None:
+            # start from the rows around the point
+            start = point.y - RectIndex.bucket_size
+            end = point.y + RectIndex.bucket_size
+        else:
+            start, end = self.viewport
+        while True:
+            self.parse_rows(max(start, 0), end)
+            rect_id = self.rect_index.find_nearest(point, direction)
+            if start <= 0 and end >= len(self.buf_table):
+                return rect_id
+            if rect_id is not None:
+                reach = int(math.sqrt(Points.calc_point_distance(
+                    point, Point(*self.rect_index.order_key(rect_id))))) + 1
+                if start <= point.y - reach and point.y + reach < end:
+                    return rect_id
+            span = max(end - start, 1)
+            start -= span
+            end += span
 
     def get_rect_on_cursor(self, point):
-        rects = self.find_rects()
-        if not rects:
+        # a rect around the point lies in the block of the point's row
+        self.parse_rows(point.y, point.y + 1)
+        rect_id = self.rect_index.find_containing(point)
+        if rect_id is None:
             return None
-
-        for rect in rects:
-            if rect.edges['UL'].y <= point.y and rect.edges['LL'].y >= point.y:
-                if rect.edges['UL'].x <= point.x and rect.edges['UR'].x >= point.x:
-                    return rect
-        return None
+        return self.get_rect(rect_id)
 
     def relabel(self, char, rect):
+        self.touch_rows(rect.edges['UL'].y + 1, rect.edges['UL'].y + 2)
         self.buf_table[rect.edges['UL'].y + 1][rect.edges['UL'].x + 1] = char
 
     def padding(self, point):
         if self.is_accesible_point(point):
             return
+        self.touch_rows(min(point.y, len(self.buf_table)), point.y + 1)
         if point.y >= len(self.buf_table):
             number_of_adding_line = point.y - (len(self.buf_table) - 1)
             for i in range(number_of_adding_line):
-                self.buf_table.append([])
+                self.buf_table.append(self.make_row())
         line = self.buf_table[point.y]
         padding_len = (point.x + 1) - len(line)
         for i in range(padding_len):
             line.insert(len(line), " ")
 
+    def byte_col(self, y, x):
+        """byte offset of column x in row y, as extmarks count columns."""
+        return len(self.buf_table[y][:x].tounicode().encode('utf-8'))
+
+    def byte_len(self, y, start_x, end_x):
+        return len(self.buf_table[y][start_x:end_x].tounicode().encode('utf-8'))
+
     def get_char_with_point(self, point):
         return self.buf_table[point.y][point.x]
 
     def set_char_with_point(self, set_char, point):
         if not self.is_accesible_point(point):
             self.padding(point)
+        self.touch_rows(point.y, point.y + 1)
         self.buf_table[point.y][point.x] = set_char
 
     def set_rect(self, rect):
@@ -641,12 +2440,61 @@ class Buffer(object):
         if len(rect.label) == 0:
             # pack `|   |` -> `||`
             label_line = self.buf_table[rect.label_points['START'].y]
+            self.touch_rows(rect.label_points['START'].y,
+                            rect.label_points['START'].y + 1)
             del label_line[rect.label_points['START'].x:rect.label_points['END'].x-1]
             return
         points = Points.generate_range_point(rect.label_points['START'], rect.label_points['END'])
         for i, p in enumerate(points):
             self.set_char_with_point(rect.label[i], p)
 
+    @classmethod
+    def render_rect(cls, rect):
+        """
+        return the (y, x, text) runs `set_rect` draws for rect.
+
+        the border and label rows are one run from the left end, the
+        other rows are their two side cells.
+        """
+        left_x = min(rect.left, rect.lower_left)
+        runs = []
+        for y in range(rect.top, rect.bottom + 1):
+            if y in (rect.top, rect.top + 1, rect.bottom):
+                runs.append((y, left_x, cls.render_row(rect, y, left_x)))
+            else:
+                runs.append((y, rect.left, Rect.vertical_line_shape))
+                runs.append((y, rect.right, Rect.vertical_line_shape))
+        return runs
+
+    @classmethod
+    def render_row(cls, rect, y, left_x):
+        """row y of rect from left_x, drawn in the order of `set_rect`."""
+        row = [' '] * (rect.right + 1 - left_x)
+        if y == rect.top:
+            row[rect.left - left_x:] = \
+                Rect.horizon_line_shape * (rect.right + 1 - rect.left)
+        if y == rect.bottom:
+            row[rect.lower_left - left_x:] = \
+                Rect.horizon_line_shape * (rect.right + 1 - rect.lower_left)
+        row[rect.right - left_x] = Rect.vertical_line_shape
+        row[rect.left - left_x] = Rect.vertical_line_shape
+        if y == rect.top:
+            row[rect.left - left_x] = row[rect.right - left_x] = \
+                Rect.edge_shape
+        if y == rect.bottom:
+            row[rect.lower_left - left_x] = row[rect.right - left_x] = \
+                Rect.edge_shape
+        if y == rect.top + 1:
+            start = rect.left + 1 - left_x
+            if len(rect.label) == 0:
+                # packed like `set_rect` does
+                del row[start:rect.right - left_x]
+            else:
+                for x, char in zip(range(start, rect.right - left_x),
+                                   rect.label):
+                    row[x] = char
+        return ''.join(row)
+
     def is_accesible_point(self, point):
         try:
             self.buf_table[point.y][point.x]
@@ -655,11 +2503,12 @@ class Buffer(object):
         return True
 
     def reshape_rect(self, rect):
+        """fit the borders of rect to its label, return True if changed."""
         start_point = rect.get_label_start_point()
         end_point = None
         # nothing to do
         if not self.is_accesible_point(start_point):
-            __logger__.info('[I] not accesible point ' + inspect.currentframe().f_code.co_name)
+            __logger__.info('[I] not accesible point reshape_rect')
             return
 
         cline = self.buf_table[start_point.y]
@@ -669,8 +2518,8 @@ class Buffer(object):
                 end_point = Point(start_point.y, start_point.x + i)
                 break
         if end_point is None:
-            __logger__.info('[I] does not exsit vertical_line_shape ' 
-                            + inspect.currentframe().f_code.co_name)
+            __logger__.info('[I] does not exsit vertical_line_shape '
+                            'reshape_rect')
             return
 
         # case edge_shape pos eqall vertical_line_shape pos
@@ -678,19 +2527,30 @@ class Buffer(object):
         if end_point.x == rect.edges['UR'].x:
             return
 
+        self.touch_rows(start_point.y - 1, start_point.y + 2)
+        x = start_point.x
         # in
         if end_point.x < rect.edges['UR'].x:
-            for i in range(diffx_of_edge_and_vline):
-                del self.buf_table[start_point.y - 1][start_point.x]
-                del self.buf_table[start_point.y + 1][start_point.x]
-            return
+            for y in (start_point.y - 1, start_point.y + 1):
+                del self.buf_table[y][x:x + diffx_of_edge_and_vline]
+            return True
 
         # out
         if end_point.x > rect.edges['UR'].x:
-            for i in range(diffx_of_edge_and_vline):
-                self.buf_table[start_point.y - 1].insert(start_point.x, Rect.horizon_line_shape)
-                self.buf_table[start_point.y + 1].insert(start_point.x, Rect.horizon_line_shape)
-            return
+            border = self.make_row(
+                Rect.horizon_line_shape * diffx_of_edge_and_vline)
+            for y in (start_point.y - 1, start_point.y + 1):
+                self.buf_table[y][x:x] = border
+            return True
+
+    def has_left_side(self, rect):
+        """whether the left side of rect is still in the buffer."""
+        if rect.bottom >= len(self.buf_table):
+            return False
+        column = [self.buf_table[y][rect.left:rect.left + 1].tounicode()
+                  for y in range(rect.top, rect.bottom + 1)]
+        return column == [Rect.edge_shape] + [Rect.vertical_line_shape] * (
+            len(column) - 2) + [Rect.edge_shape]
 
 
     def find_no_right_end_rects(self):
@@ -698,8 +2558,8 @@ class Buffer(object):
 
         edge_points = self.find_edge_points()
         if not edge_points:
-            __logger__.info('[I] :does not find edges!!'
-                            + inspect.currentframe().f_code.co_name)
+            __logger__.info('[I] :does not find edges!! '
+                            'find_no_right_end_rects')
             return None
         for point in edge_points:
             upper_right_point = self.find_upper_right_point(point)
@@ -718,30 +2578,67 @@ class Buffer(object):
 
 
     def find_rects(self):
-        rects = []
-
-        edge_points = self.find_edge_points()
-        if not edge_points:
-            return rects
+        return list(self.iter_rects())
 
-        for upper_left_point in edge_points:
-            upper_right_point = self.find_upper_right_point(upper_left_point)
-            if upper_right_point is None:
-                continue
-            lower_right_point = self.find_lower_right_point(upper_right_point)
-            if lower_right_point is None:
-                continue
-            lower_left_point = self.find_lower_left_point(lower_right_point)
-            if lower_left_point is None:
-                continue
+    def iter_rects(self, start=0, end=None):
+        """
+        yield the rects whose upper edge is in rows [start, end) in row order.
 
-            rect_in_lines = [line[upper_left_point.x+1:upper_right_point.x] for line in self.buf_table[upper_left_point.y+1:lower_left_point.y]]
-            rects.append(
-                Rect(upper_left_point, upper_right_point, lower_right_point, lower_left_point, rect_in_lines))
+        rows are parsed a block at a time as the rects are consumed, so a
+        caller that stops early does not pay for the rest of the buffer.
+        the rects are new values, the parsed rects stay in the table.
+        """
+        if end is None or end > len(self.buf_table):
+            end = len(self.buf_table)
+        y = start
+        while y < end:
+            chunk_end = min(y + RectIndex.bucket_size, end)
+            self.parse_rows(y, chunk_end)
+            rect_ids = [rect_id for rect_id
+                        in self.rect_index.find_in_rows(y, chunk_end)
+                        if self.rect_table.top(rect_id) >= y]
+            for rect_id in sorted(rect_ids, key=self.rect_index.order_key):
+                yield self.get_rect(rect_id)
+            y = chunk_end
+
+    def scan_rects(self, start=0, end=None):
+        """
+        detect the rects whose rows all lie in [start, end), as
+        `RectTable` values.
+        """
+        if end is None:
+            end = len(self.buf_table)
+        grid = self.get_grid()
+        if grid is not None:
+            edges, links = grid.link_edges(start, end)
+        elif self.band_workers and end - start >= self.band_threshold:
+            edges, links, _ = RectScanner.link_bands(
+                self.buf_table[start:end], start, self.get_band_executor(),
+                self.band_workers * 4)
+        else:
+            edges, links, _ = RectScanner.link_edges(
+                self.buf_table[start:end], start)
+        return RectScanner.build_rects(edges, links)
 
-        return rects
+    @classmethod
+    def get_band_executor(cls):
+        if cls.band_executor is None:
+            # the plugin host runs threads and owns the rpc channel, so the
+            # workers are not forked from it. they import this module from
+            # its directory, which need not be on their sys.path
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn')
+            cls.band_executor = futures.ProcessPoolExecutor(
+                cls.band_workers, mp_context=context,
+                initializer=site.addsitedir,
+                initargs=(os.path.dirname(os.path.abspath(__file__)),))
+        return cls.band_executor
 
     def find_edge_points(self):
+        grid = self.get_grid()
+        if grid is not None:
+            return [Point(y, x) for y, x in grid.edge_points()]
         edge_points = []
         for y, line in enumerate(self.buf_table):
             for x, s in enumerate(line):
@@ -857,6 +2754,7 @@ class Buffer(object):
         self.print_rect(rect)
 
     def print_rect(self, rect):
+        self.touch_rows(rect.edges['UL'].y, rect.edges['LL'].y + 1)
         for count, edge in enumerate(rect.edges.values()):
             self.buf_table[edge.y][edge.x] = Rect.edge_shape
 
@@ -867,8 +2765,8 @@ class Buffer(object):
 
     def print_vs_line(self, left_point, right_point):
         line = self.buf_table[left_point.y]
-        strs = [Rect.horizon_line_shape] * ((right_point.x - left_point.x) - 1)
-        line[left_point.x+1:right_point.x] = strs
+        strs = Rect.horizon_line_shape * ((right_point.x - left_point.x) - 1)
+        line[left_point.x+1:right_point.x] = self.make_row(strs)
 
     def print_hs_line(self, upper_point, lower_point):
         lines = self.buf_table[upper_point.y+1:lower_point.y]
@@ -884,3 +2782,129 @@ class Buffer(object):
             for s in line:
                 print(s, end="")
             print("")
+
+
+def correct_format(lines):
+    """
+    the `RecterCorrectFormat` fix of lines outside of vim.
+
+    return the fixed lines and the number of rects reshaped.
+    """
+    buf = Buffer(lines)
+    reshaped = 0
+    for rect in buf.find_no_right_end_rects() or []:
+        if buf.reshape_rect(rect):
+            reshaped += 1
+    return [row.tounicode() for row in buf.buf_table], reshaped
+
+
+def process_file(job):
+    """
+    run command on one file, in a worker process of `main`.
+
+    return (path, reshaped rect count, output lines, error).
+    """
+    command, path = job
+    try:
+        with open(path, encoding='utf-8', newline='') as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError) as error:
+        return path, 0, [], str(error)
+    # every line keeps its own line ending when the file is written back
+    parts = re.split('(\r\n|\r|\n)', text)
+    lines, endings = parts[0::2], parts[1::2]
+    if command == 'list':
+        output = ['{}:{}:{}: {}x{} {}'.format(
+            path, rect.top + 1, rect.left + 1,
+            rect.right - rect.left + 1, rect.bottom - rect.top + 1,
+            ''.join(rect.label).strip())
+            for rect in Buffer(lines).iter_rects()]
+        return path, 0, output, None
+    fixed, reshaped = correct_format(lines)
+    if command == 'format' and fixed != lines:
+        endings += [endings[0] if endings else '\n'] * \
+            (len(fixed) - 1 - len(endings))
+        try:
+            write_atomic(path, ''.join(
+                line + ending for line, ending in zip(fixed, endings + [''])))
+        except OSError as error:
+            return path, reshaped, [], str(error)
+    return path, reshaped, [], None
+
+
+def write_atomic(path, text):
+    """replace path with text, readers see the old or the new file only."""
+    # a symlink stays a symlink, its target is replaced
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.recter-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def iter_paths(paths, pattern):
+    """the files of paths, directories walked for files matching pattern."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(fnmatch.filter(files, pattern)):
+                yield os.path.join(root, name)
+
+
+def main(argv=None):
+    """
+    batch `RecterCorrectFormat` for diagram files, without neovim.
+
+        python Recter.py format docs/
+        python Recter.py check docs/     # exit 1 if format would change
+        python Recter.py list a.txt      # path:line:col: WxH label
+    """
+    parser = argparse.ArgumentParser(
+        prog='Recter', description='reshape or list the rects of files')
+    parser.add_argument('command', choices=['format', 'check', 'list'])
+    parser.add_argument('paths', nargs='+', help='files or directories')
+    parser.add_argument('--pattern', default='*.txt',
+                        help='files read from directories (%(default)s)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes, 1 runs in this process')
+    args = parser.parse_args(argv)
+
+    jobs = ((args.command, path)
+            for path in iter_paths(args.paths, args.pattern))
+    executor = None
+    if args.jobs == 1:
+        results = map(process_file, jobs)
+    else:
+        executor = futures.ProcessPoolExecutor(args.jobs)
+        results = executor.map(process_file, jobs, chunksize=16)
+    status = 0
+    try:
+        for path, reshaped, output, error in results:
+            if error is not None:
+                print('{}: {}'.format(path, error), file=sys.stderr)
+                status = 2
+            elif output:
+                print('\n'.join(output))
+            elif reshaped:
+                print('{}: {} {} rects'.format(
+                    path, 'reshaped' if args.command == 'format'
+                    else 'would reshape', reshaped))
+                if args.command == 'check':
+                    status = max(status, 1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+benchmarks of the Recter Buffer hot paths. neovim is not needed.
+
+    python bench_recter.py [--sizes 100 1000] [--output results.json]
+                           [--baseline baseline.json] [--tolerance 1.25]
+
+every benchmark is timed on every generated diagram at every size. results
+are written as JSON, and compared against a baseline written by an earlier
+run, if one is given. the exit status is 1 when a benchmark got slower than
+tolerance times its baseline.
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import Recter
+
+
+def generate_diagram(rect_rows, rect_cols=8, width=10, height=4):
+    """generate rect_rows x rect_cols labeled rects."""
+    lines = []
+    for row in range(rect_rows):
+        border = ''
+        label = ''
+        side = ''
+        for col in range(rect_cols):
+            text = 'r{}c{}'.format(row, col)[:width - 1]
+            border += '+' + '-' * (width - 1) + '+  '
+            label += '|' + text.ljust(width - 1) + '|  '
+            side += '|' + ' ' * (width - 1) + '|  '
+        lines.append(border)
+        lines.append(label)
+        lines.extend([side] * (height - 3))
+        lines.append(border)
+        lines.append('')
+    return lines
+
+
+def generate_nested(groups, depth=4, width=40):
+    """generate groups of rects nested depth deep."""
+    lines = []
+    for group in range(groups):
+        rows = [[' '] * (width + 1) for y in range(depth * 2 + 2)]
+        for level in range(depth):
+            top = level
+            bottom = len(rows) - 1 - level
+            left = level * 2
+            right = width - level * 2
+            for x in range(left, right + 1):
+                rows[top][x] = rows[bottom][x] = '-'
+            for y in range(top, bottom + 1):
+                rows[y][left] = rows[y][right] = '|'
+            for y, x in ((top, left), (top, right),
+                         (bottom, left), (bottom, right)):
+                rows[y][x] = '+'
+        lines.extend(''.join(row).rstrip() for row in rows)
+        lines.append('')
+    return lines
+
+
+def generate_touching(rect_rows, rect_cols=8, width=6):
+    """generate a table of rects sharing their borders."""
+    border = ('+' + '-' * (width - 1)) * rect_cols + '+'
+    lines = [border]
+    for row in range(rect_rows):
+        lines.append(''.join(
+            '|' + 't{}'.format(col).ljust(width - 1)
+            for col in range(rect_cols)) + '|')
+        lines.append(border)
+    return lines
+
+
+def generate_junctions(rows, cols=40):
+    """generate a dense lattice of `+` junctions with 1 cell rects."""
+    border = '+-' * cols + '+'
+    side = '| ' * cols + '|'
+    lines = [border]
+    for row in range(rows):
+        lines.extend([side, border])
+    return lines
+
+
+def generate_long_lines(rect_rows, width=2000):
+    """generate rects at the end of long lines of text."""
+    text = 'x' * width
+    lines = []
+    for row in range(rect_rows):
+        lines.extend([
+            text + ' +------+',
+            text + ' |long  |',
+            text + ' +------+',
+            ''])
+    return lines
+
+
+GENERATORS = [
+    ('grid', lambda size: generate_diagram(max(size // 40, 1))),
+    ('nested', lambda size: generate_nested(max(size // 10, 1))),
+    ('touching', lambda size: generate_touching(max(size // 2, 1))),
+    ('junctions', lambda size: generate_junctions(max(size // 2, 1))),
+    ('long_lines', lambda size: generate_long_lines(max(size // 4, 1))),
+]
+
+
+def time_op(setup, op, repeat):
+    """best of repeat runs of op(setup()), timing op only."""
+    best = None
+    for i in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        op(arg)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def widen_labels(buf, rects):
+    # type past the right border of every label like insert mode does
+    for rect in rects:
+        buf.buf_table[rect.top + 1].insert(rect.left + 1, 'w')
+
+
+def reshapeable(rects):
+    """the rightmost rect of every row that is not inside another rect.
+
+    widening one of them shifts nothing the others are made of."""
+    rightmost = {}
+    for rect in rects:
+        if any(other.top <= rect.top and other.bottom >= rect.bottom
+               and other.left < rect.left and other.right > rect.right
+               for other in rects):
+            continue
+        if rect.top not in rightmost or rightmost[rect.top].left < rect.left:
+            rightmost[rect.top] = rect
+    return [rightmost[top] for top in sorted(rightmost)]
+
+
+def move_session(buf, rect, steps=20):
+    """what move mode does for a drag of steps keys and its write."""
+    moved = rect
+    for direction in [Recter.Direction.R, Recter.Direction.D] * (steps // 2):
+        moved = moved.move(direction)
+        Recter.Buffer.render_rect(moved)
+    buf.delete_rect(rect)
+    buf.set_rect(moved)
+    buf.pop_dirty_ranges()
+
+
+def bench(lines, backend, repeat=5, queries=50):
+    """time every benchmark on lines, in seconds."""
+    def fresh():
+        return Recter.Buffer(lines, grid_backend=backend)
+
+    def parsed():
+        buf = fresh()
+        buf.parse_rows()
+        return buf
+
+    buf = parsed()
+    rects = [rect for rect in buf.find_rects()
+             if rect.lower_left == rect.left]
+    rnd = random.Random(0)
+    width = max(len(line) for line in lines) or 1
+    points = [Recter.Point(rnd.randrange(len(lines)), rnd.randrange(width))
+              for i in range(queries)]
+    picked = rnd.sample(rects, min(queries, len(rects)))
+    inner = [rect.get_label_start_point() for rect in picked]
+    wide = reshapeable(rects)[:queries]
+
+    def with_rects():
+        return parsed(), picked
+
+    def with_wide_labels():
+        buf = fresh()
+        widen_labels(buf, wide)
+        return buf, wide
+
+    results = {
+        'find_rects': time_op(fresh, lambda buf: buf.find_rects(), repeat),
+        'find_no_right_end_rects': time_op(
+            fresh, lambda buf: buf.find_no_right_end_rects(), repeat),
+        'get_rect_on_cursor': time_op(
+            parsed, lambda buf: [buf.get_rect_on_cursor(point)
+                                 for point in inner], repeat),
+        'get_rect_on_cursor_cold': time_op(
+            fresh, lambda buf: [buf.get_rect_on_cursor(point)
+                                for point in inner], repeat),
+        'find_rect_nearest_neighbor': time_op(
+            parsed, lambda buf: [buf.find_rect_nearest_neighbor(point)
+                                 for point in points], repeat),
+        'set_rect': time_op(
+            with_rects, lambda args: [args[0].set_rect(rect)
+                                      for rect in args[1]], repeat),
+        'delete_rect': time_op(
+            with_rects, lambda args: [args[0].delete_rect(rect)
+                                      for rect in args[1]], repeat),
+        'reshape_rect': time_op(
+            with_wide_labels, lambda args: [args[0].reshape_rect(rect)
+                                            for rect in args[1]], repeat),
+    }
+    if picked:
+        results['move_session'] = time_op(
+            with_rects, lambda args: move_session(args[0], args[1][0]),
+            repeat)
+    return results
+
+
+def run(sizes, backends, repeat):
+    results = {}
+    for size in sizes:
+        for name, generate in GENERATORS:
+            lines = generate(size)
+            for backend in backends:
+                for op, seconds in bench(lines, backend, repeat).items():
+                    key = '{}/{}/{}/{}'.format(name, size, backend, op)
+                    results[key] = seconds
+                    print('{:<55} {:10.6f}s'.format(key, seconds))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """return the benchmarks slower than tolerance times the baseline."""
+    regressions = []
+    for key, seconds in sorted(results.items()):
+        base = baseline.get(key)
+        if base and seconds > base * tolerance:
+            regressions.append((key, base, seconds))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recter benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100, 1000],
+                        help='diagram sizes in lines')
+    parser.add_argument('--backend', nargs='+', default=None,
+                        help="grid backends, 'list' and 'numpy'")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    backends = args.backend
+    if backends is None:
+        backends = ['list']
+        if Recter.numpy is not None:
+            backends.append('numpy')
+    results = run(args.sizes, backends, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'sizes': args.sizes, 'backends': backends,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for key, base, seconds in regressions:
+            print('regression {}: {:.6f}s -> {:.6f}s ({:.2f}x)'.format(
+                key, base, seconds, seconds / base))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
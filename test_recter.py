@@ -0,0 +1,249 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import Recter
+
+
+class SerialExecutor(object):
+    """runs `map` in this process, like a pool of one worker."""
+
+    def map(self, func, *iterables):
+        return map(func, *iterables)
+
+
+def random_diagram(rnd, height, width):
+    rows = [[rnd.choice(' ' * 6 + 'x') for x in range(width)]
+            for y in range(height)]
+    for i in range(rnd.randrange(1, 12)):
+        top = rnd.randrange(height - 1)
+        left = rnd.randrange(width - 1)
+        bottom = rnd.randrange(top + 1, min(top + 30, height))
+        right = rnd.randrange(left + 1, width)
+        for x in range(left, right + 1):
+            rows[top][x] = rows[bottom][x] = '-'
+        for y in range(top, bottom + 1):
+            rows[y][left] = rows[y][right] = '|'
+        for y, x in ((top, left), (top, right), (bottom, left),
+                     (bottom, right)):
+            rows[y][x] = '+'
+    # ragged line ends cut runs like short lines in a real buffer
+    return [Recter.Buffer.make_row(''.join(row[:rnd.randrange(width + 1)]))
+            for row in rows]
+
+
+class LinkBandsTest(unittest.TestCase):
+
+    def assert_same_links(self, lines, band_count, start_y=0,
+                          col_open=None):
+        col_open = col_open or {}
+        serial = Recter.RectScanner.link_edges(
+            [line.tounicode() for line in lines], start_y, dict(col_open))
+        banded = Recter.RectScanner.link_bands(
+            lines, start_y, SerialExecutor(), band_count, dict(col_open))
+        self.assertEqual(sorted(serial[0]), sorted(banded[0]))
+        self.assertEqual(serial[1], banded[1])
+        self.assertEqual(serial[2], banded[2])
+
+    def test_matches_link_edges(self):
+        rnd = random.Random(0)
+        for i in range(300):
+            lines = random_diagram(rnd, rnd.randrange(2, 60),
+                                   rnd.randrange(2, 30))
+            self.assert_same_links(lines, rnd.randrange(1, 12))
+
+    def test_runs_open_above_the_first_band(self):
+        lines = [Recter.Buffer.make_row(line) for line in
+                 ['|  |', '|  +', '|', '+--+']]
+        for band_count in range(1, 5):
+            self.assert_same_links(lines, band_count, start_y=5,
+                                   col_open={0: (4, False), 3: (4, True)})
+
+    def test_band_executor(self):
+        lines = random_diagram(random.Random(1), 40, 30)
+        band_workers = Recter.Buffer.band_workers
+        Recter.Buffer.band_workers = 2
+        executor = Recter.Buffer.get_band_executor()
+        try:
+            serial = Recter.RectScanner.link_edges(
+                [line.tounicode() for line in lines])
+            banded = Recter.RectScanner.link_bands(lines, 0, executor, 4)
+            self.assertEqual(serial[1], banded[1])
+        finally:
+            executor.shutdown()
+            Recter.Buffer.band_executor = None
+            Recter.Buffer.band_workers = band_workers
+
+
+class UndoJournalTest(unittest.TestCase):
+    lines = ['+---+', '|ab |', '+---+', 'text']
+
+    def setUp(self):
+        self.buf = Recter.Buffer(self.lines)
+        self.journal = self.buf.journal
+
+    def text(self):
+        return [row.tounicode() for row in self.buf.buf_table]
+
+    def move_down(self, distance):
+        rect = self.buf.get_rect_on_cursor(Recter.Point(1, 1))
+        moved = rect
+        for i in range(distance):
+            moved = moved.move(Recter.Direction.D)
+        self.buf.delete_rect(rect)
+        self.buf.set_rect(moved)
+        self.journal.commit(self.buf.buf_table, 1)
+
+    def test_round_trip(self):
+        self.move_down(3)
+        moved = self.text()
+        self.assertGreater(len(moved), len(self.lines))
+        self.buf.revert(self.journal.pop())
+        self.journal.replaying = 'undo'
+        self.journal.commit(self.buf.buf_table, 2)
+        self.assertEqual(self.text(), self.lines)
+        self.buf.revert(self.journal.pop(redo=True))
+        self.journal.replaying = 'redo'
+        self.journal.commit(self.buf.buf_table, 3)
+        self.assertEqual(self.text(), moved)
+        self.assertEqual(len(self.journal.undo_entries), 1)
+
+    def test_commit_without_edit(self):
+        self.journal.commit(self.buf.buf_table, 1)
+        self.assertEqual(self.journal.undo_entries, [])
+        self.move_down(3)
+        self.journal.commit(self.buf.buf_table, 2)
+        self.assertEqual(len(self.journal.undo_entries), 1)
+
+
+class RenderRectTest(unittest.TestCase):
+
+    def assert_renders_like_set_rect(self, rect):
+        canvas = Recter.Buffer([' ' * (rect.right + 1)] * (rect.bottom + 1))
+        canvas.set_rect(rect)
+        for y, x, text in Recter.Buffer.render_rect(rect):
+            self.assertEqual(canvas.buf_table[y][x:x + len(text)].tounicode(),
+                             text)
+
+    def test_matches_set_rect(self):
+        buf = Recter.Buffer(['', '  +---+', '  |ab |', '  |   |', '  +---+'])
+        rect = buf.get_rect_on_cursor(Recter.Point(2, 3))
+        self.assertEqual(Recter.Buffer.render_rect(rect), [
+            (1, 2, '+---+'), (2, 2, '|ab |'), (3, 2, '|'), (3, 6, '|'),
+            (4, 2, '+---+')])
+        self.assert_renders_like_set_rect(rect)
+        self.assert_renders_like_set_rect(rect.translate(3, 7))
+
+    def test_packs_empty_label(self):
+        rect = Recter.Rect.from_values((0, 1, 5, 2, 1, 0), [])
+        self.assertEqual(Recter.Buffer.render_rect(rect),
+                         [(0, 1, '+---+'), (1, 1, '||'), (2, 1, '+---+')])
+
+
+class MainTest(unittest.TestCase):
+    fixed = '+-----+\n|ab   |\n+-----+\n'
+    broken = '+---+\n|abcdef|\n+---+\n'
+    wrapped = '+----+\n|abc|\n+----+\n'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def main(self, *args):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(stderr):
+            status = Recter.main(list(args) + ['--jobs', '1'])
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_check(self):
+        fixed = self.write('fixed.txt', self.fixed)
+        broken = self.write('sub/broken.txt', self.broken)
+        self.assertEqual(self.main('check', fixed), (0, '', ''))
+        status, out, err = self.main('check', self.directory)
+        self.assertEqual(status, 1)
+        self.assertEqual(out, '{}: would reshape 1 rects\n'.format(broken))
+        self.assertEqual(self.read(broken), self.broken)
+
+    def test_counts_only_changed_rects(self):
+        # the open label below is a candidate that cannot be reshaped
+        path = self.write('mixed.txt', self.broken + '\n+---+\n|ab\n+---+\n')
+        self.assertEqual(self.main('check', path),
+                         (1, '{}: would reshape 1 rects\n'.format(path), ''))
+
+    def test_format(self):
+        fixed = self.write('fixed.txt', self.fixed)
+        broken = self.write('broken.txt', self.broken)
+        wrapped = self.write('wrapped.txt', self.wrapped)
+        os.chmod(broken, 0o640)
+        status, out, err = self.main('format', self.directory)
+        self.assertEqual(status, 0)
+        self.assertEqual(out, '{}: reshaped 1 rects\n{}: reshaped 1 rects\n'
+                         .format(broken, wrapped))
+        self.assertEqual(self.read(fixed), self.fixed)
+        self.assertEqual(self.read(broken),
+                         '+------+\n|abcdef|\n+------+\n')
+        self.assertEqual(self.read(wrapped), '+---+\n|abc|\n+---+\n')
+        self.assertEqual(os.stat(broken).st_mode & 0o777, 0o640)
+        self.assertEqual(self.main('check', self.directory), (0, '', ''))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['broken.txt', 'fixed.txt', 'wrapped.txt'])
+
+    def test_format_symlink(self):
+        broken = self.write('broken.txt', self.broken)
+        link = os.path.join(self.directory, 'link.txt')
+        os.symlink(broken, link)
+        self.assertEqual(self.main('format', link)[0], 0)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(broken),
+                         '+------+\n|abcdef|\n+------+\n')
+
+    def test_format_line_endings(self):
+        path = os.path.join(self.directory, 'crlf.txt')
+        with open(path, 'wb') as f:
+            f.write(b'+---+\r\n|abcdef|\r\n+---+\n\r\n')
+        self.assertEqual(self.main('format', path)[0], 0)
+        with open(path, 'rb') as f:
+            self.assertEqual(
+                f.read(), b'+------+\r\n|abcdef|\r\n+------+\n\r\n')
+
+    def test_list(self):
+        path = self.write('fixed.txt', self.fixed + '\n  +--+\n  |x |\n'
+                          '  +--+\n')
+        self.assertEqual(self.main('list', path), (
+            0, '{0}:1:1: 7x3 ab\n{0}:5:3: 4x3 x\n'.format(path), ''))
+
+    def test_errors(self):
+        missing = os.path.join(self.directory, 'missing.txt')
+        fixed = self.write('fixed.txt', self.fixed)
+        status, out, err = self.main('check', missing, fixed)
+        self.assertEqual(status, 2)
+        self.assertTrue(err.startswith(missing + ': '))
+        status, out, err = self.main('format', missing)
+        self.assertEqual(status, 2)
+
+    def test_process_pool(self):
+        broken = self.write('broken.txt', self.broken)
+        with contextlib.redirect_stdout(io.StringIO()):
+            status = Recter.main(['check', '--jobs', '2', broken])
+        self.assertEqual(status, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()